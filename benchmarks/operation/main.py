@@ -0,0 +1,226 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from models.operation.main import run_operation_model
+from models.operation.main import run_operation_model_parallel
+from utils.config import Config
+from utils.db import create_db_conn
+from utils.db import init_project_db
+from utils.input_cache import find_input_file
+from utils.input_cache import read_input_file
+from utils.tables import InputTables
+from utils.tables import OutputTables
+from utils.timer import summarize_stages
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+try:
+    import psutil
+except ImportError:  # optional, the peak RSS of the parallel modes is not measured without it
+    psutil = None
+
+# the size/capacity column of the components that a household may or may not have
+OPTIONAL_COMPONENTS = {
+    "PV": "size",
+    "Battery": "capacity",
+    "Vehicle": "capacity",
+    "SpaceHeatingTank": "size",
+    "HotWaterTank": "size",
+}
+# share of the households that have the component
+DEFAULT_COMPONENT_SHARES = {
+    "PV": 0.5,
+    "Battery": 0.3,
+    "Vehicle": 0.3,
+    "SpaceHeatingTank": 0.5,
+    "HotWaterTank": 0.7,
+}
+BENCHMARK_MODES = {
+    "ref": {"run_ref": True, "run_opt": False},
+    "opt": {"run_ref": False, "run_opt": True},
+    "ref_opt": {"run_ref": True, "run_opt": True},
+}
+
+
+def get_config(
+    project_name: str = "benchmark_operation",
+    input_folder: str = os.path.join(os.path.dirname(__file__), "..", "..", "tests", "operation", "input")
+) -> "Config":
+    config = Config(project_name=project_name, project_path=os.path.dirname(__file__))
+    config.input = os.path.abspath(input_folder)
+    return config
+
+
+def gen_synthetic_scenarios(
+    input_tables: Dict[str, pd.DataFrame],
+    household_num: int,
+    component_shares: Optional[Dict[str, float]] = None,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Generates an OperationScenario table with household_num households from the test input tables.
+    Each household starts from a randomly drawn existing scenario (so that building and tank sizes fit together),
+    gets a random boiler and has PV, battery, EV and thermal tanks with the probability given in component_shares.
+    """
+    shares = DEFAULT_COMPONENT_SHARES.copy()
+    if component_shares is not None:
+        shares.update(component_shares)
+    rng = np.random.default_rng(seed)
+    base_scenarios = input_tables[InputTables.OperationScenario.name]
+    scenarios = base_scenarios.iloc[rng.integers(0, len(base_scenarios), household_num)].reset_index(drop=True)
+    boiler_ids = input_tables[InputTables.OperationScenario_Component_Boiler.name]["ID_Boiler"].to_numpy()
+    scenarios["ID_Boiler"] = rng.choice(boiler_ids, household_num)
+    for component, size_column in OPTIONAL_COMPONENTS.items():
+        id_name = f"ID_{component}"
+        df = input_tables[f"OperationScenario_Component_{component}"]
+        absent_ids = df.loc[df[size_column] == 0, id_name].to_numpy()
+        present_ids = df.loc[df[size_column] > 0, id_name].to_numpy()
+        if len(absent_ids) == 0 or len(present_ids) == 0:
+            continue
+        base_ids = scenarios[id_name].to_numpy()
+        base_present = np.isin(base_ids, present_ids)
+        present_choice = np.where(base_present, base_ids, rng.choice(present_ids, household_num))
+        has_component = rng.uniform(size=household_num) < shares[component]
+        scenarios[id_name] = np.where(has_component, present_choice, absent_ids[0])
+    scenarios["ID_Scenario"] = np.arange(1, household_num + 1)
+    return scenarios
+
+
+def setup_benchmark_db(config: "Config", household_num: int, seed: int = 0):
+    init_project_db(config)
+    db = create_db_conn(config)
+    # the base scenarios are read from the input files, because the database holds the synthetic scenarios of the
+    # previous run until init_project_db reloads them
+    input_tables = {
+        table_name: read_input_file(find_input_file(config.input, table_name))
+        for table_name in [InputTables.OperationScenario.name, InputTables.OperationScenario_Component_Boiler.name] +
+                          [f"OperationScenario_Component_{component}" for component in OPTIONAL_COMPONENTS.keys()]
+    }
+    db.write_dataframe(
+        table_name=InputTables.OperationScenario.name,
+        data_frame=gen_synthetic_scenarios(input_tables, household_num, seed=seed),
+        if_exists="replace"
+    )
+
+
+class RssSampler:
+
+    def __init__(self, interval: float = 0.1):
+        """
+        Samples the resident memory of this process and all its child processes (e.g. the worker processes of
+        the parallel modes) every `interval` seconds from a background thread, and keeps the peak of the sum.
+        Needs psutil.
+        """
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop_event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._sampler.join()
+        self._sample_once()
+
+    def _sample_once(self):
+        process = psutil.Process()
+        rss = 0
+        for p in [process] + process.children(recursive=True):
+            try:
+                rss += p.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample_once()
+
+    @property
+    def peak_rss_mb(self) -> float:
+        return self.peak_rss / 1024 ** 2
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """peak RSS of this process, without the child processes"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark_mode(mode: str, household_num: int, task_num: int, seed: int) -> dict:
+    config = get_config()
+    setup_benchmark_db(config, household_num, seed)
+    run_modes = BENCHMARK_MODES[mode.replace("_parallel", "")]
+    rss_sampler = RssSampler() if psutil is not None else None
+    if rss_sampler is not None:
+        rss_sampler.start()
+    t_start = time.perf_counter()
+    if mode.endswith("_parallel"):
+        run_operation_model_parallel(config=config, task_num=task_num, **run_modes)
+    else:
+        run_operation_model(config=config, **run_modes)
+    seconds = time.perf_counter() - t_start
+    if rss_sampler is not None:
+        rss_sampler.stop()
+        peak_rss_mb = rss_sampler.peak_rss_mb
+    else:
+        # the worker processes are not included in the RSS of this process
+        peak_rss_mb = None if mode.endswith("_parallel") else get_peak_rss_mb()
+    metrics = create_db_conn(config).read_dataframe(OutputTables.OperationResult_RunMetrics.name)
+    return {
+        "mode": mode,
+        "household_num": household_num,
+        "task_num": task_num if mode.endswith("_parallel") else 1,
+        "seconds": seconds,
+        "scenarios_per_second": household_num / seconds,
+        "peak_rss_mb": peak_rss_mb,
+        "stages": summarize_stages(metrics).to_dict(orient="records"),
+    }
+
+
+def run_benchmark(
+    household_num: int = 100,
+    modes: List[str] = ("ref", "opt", "ref_opt", "ref_opt_parallel"),
+    task_num: int = 4,
+    seed: int = 0,
+    file_name: Optional[str] = None
+) -> List[dict]:
+    """
+    Runs FLEX-Operation on household_num synthetic households for each mode and writes the results
+    (scenarios/s, peak RSS, per-stage durations) to a json file in the benchmark output folder.
+    Each mode runs in a fresh process, so that the peak RSS is measured for that mode alone. The peak RSS is the
+    peak of the summed RSS of the process and its workers, sampled with psutil. Without psutil, it is the peak
+    RSS of the process for the serial modes and None for the parallel modes.
+    :param modes: "ref", "opt", "ref_opt", and the same with the suffix "_parallel" for run_operation_model_parallel
+    """
+    results = []
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_benchmark_mode, mode, household_num, task_num, seed).result()
+        print(f'{mode}: {round(result["scenarios_per_second"], 3)} scenarios/s, peak RSS {result["peak_rss_mb"]} MB')
+        results.append(result)
+    if file_name is None:
+        file_name = f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(os.path.join(get_config().output, file_name), "w") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    run_benchmark(household_num=100)
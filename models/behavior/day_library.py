@@ -0,0 +1,181 @@
+import hashlib
+import os
+from typing import Dict, Optional, TYPE_CHECKING
+
+import numpy as np
+
+from models.behavior.markov import TIMESLOT_NUM
+from models.behavior.markov import get_table_hash
+from models.behavior.markov import get_year_day_types
+from models.behavior.person import sample_location
+from utils.func import get_logger
+
+if TYPE_CHECKING:
+    from models.behavior.scenario import BehaviorScenario
+
+logger = get_logger(__name__)
+
+
+class PersonDayLibrary:
+
+    array_names = ["activity", "technology", "location"]
+
+    def __init__(
+        self,
+        key: str,
+        person_types: np.ndarray,
+        teleworking_types: np.ndarray,
+        day_types: np.ndarray,
+        activity: np.ndarray,
+        technology: np.ndarray,
+        location: np.ndarray,
+    ):
+        """
+        Pool of simulated person-days for each (person type, teleworking type, day type). The days of a person
+        only depend on the day type, so a person-year is assembled by drawing one day of the pool for each day of
+        the year instead of running the activity Markov chain again.
+        The arrays have the shape (person type, teleworking type, day type, day of the pool, 144 timeslots), the
+        first three axes are indexed by the position of the ID in person_types, teleworking_types and day_types.
+        :param key: hash of the parameters, pool size and seed the pool was simulated with, see get_key
+        """
+        self.key = key
+        self.person_types = person_types
+        self.teleworking_types = teleworking_types
+        self.day_types = day_types
+        self.activity = activity
+        self.technology = technology
+        self.location = location
+        self.year_day_types = get_year_day_types()
+
+    @property
+    def pool_size(self) -> int:
+        return self.activity.shape[3]
+
+    @staticmethod
+    def get_key(scenario: "BehaviorScenario", pool_size: int, entropy: int) -> str:
+        sha = hashlib.sha1()
+        sha.update(scenario.activity_tensors.key.encode())
+        sha.update(get_table_hash([
+            scenario.technology_trigger_prob, scenario.technology_power, scenario.technology_duration
+        ]).encode())
+        sha.update(scenario.activity_location.tobytes())
+        sha.update(str(sorted(scenario.teleworking_prob.items())).encode())
+        sha.update(f"{pool_size}:{entropy}".encode())
+        return sha.hexdigest()
+
+    @classmethod
+    def build(
+        cls,
+        scenario: "BehaviorScenario",
+        pool_size: int,
+        entropy: int,
+        rng: np.random.Generator
+    ) -> "PersonDayLibrary":
+        """
+        Simulates pool_size days for each (person type, teleworking type, day type), with the activity data of
+        the scenario (see BehaviorScenario.setup_person_activity_data).
+        """
+        person_types = scenario.activity_tensors.person_types
+        teleworking_types = np.sort(np.array(list(scenario.teleworking_prob.keys())))
+        day_types = scenario.activity_tensors.day_types
+        shape = (len(person_types), len(teleworking_types), len(day_types), pool_size, TIMESLOT_NUM)
+        activity = np.empty(shape, dtype=np.int8)
+        technology = np.empty(shape, dtype=np.int16)
+        location = np.empty(shape, dtype=np.int8)
+        for p, id_person_type in enumerate(person_types):
+            for w, id_teleworking_type in enumerate(teleworking_types):
+                days = scenario.activity_sampler.sample_days(
+                    person_types=np.full(len(day_types) * pool_size, id_person_type),
+                    day_types=np.repeat(day_types, pool_size),
+                    rng=rng
+                ).ravel()
+                activity[p, w] = days.reshape(shape[2:])
+                technology[p, w] = scenario.technology_tables.sample_technologies(days, rng).reshape(shape[2:])
+                location[p, w] = sample_location(
+                    activity_profile=days,
+                    activity_location=scenario.activity_location,
+                    wfh_prob=scenario.teleworking_prob[id_teleworking_type],
+                    rng=rng
+                ).reshape(shape[2:])
+        return cls(
+            key=cls.get_key(scenario, pool_size, entropy),
+            person_types=person_types,
+            teleworking_types=teleworking_types,
+            day_types=day_types,
+            activity=activity,
+            technology=technology,
+            location=location,
+        )
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            key=np.array(self.key),
+            person_types=self.person_types,
+            teleworking_types=self.teleworking_types,
+            day_types=self.day_types,
+            **{name: getattr(self, name) for name in self.array_names}
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "PersonDayLibrary":
+        with np.load(path) as arrays:
+            return cls(key=str(arrays["key"]), **{name: arrays[name] for name in arrays.files if name != "key"})
+
+    @classmethod
+    def load_or_build(
+        cls,
+        path: str,
+        scenario: "BehaviorScenario",
+        pool_size: int,
+        entropy: int,
+        rng: np.random.Generator
+    ) -> "PersonDayLibrary":
+        """loads the library from path if it was simulated with the same parameters, otherwise builds and saves it"""
+        if os.path.exists(path):
+            library = cls.load(path)
+            if library.key == cls.get_key(scenario, pool_size, entropy):
+                return library
+        library = cls.build(scenario, pool_size, entropy, rng)
+        try:
+            library.save(path)
+        except OSError as e:
+            logger.warning(f"Person day library is not cached: {e}")
+        return library
+
+    def get_day_refs(self, person_num: int, rng: np.random.Generator) -> np.ndarray:
+        """day of the pool that each day of the year of each person refers to (persons x 365)"""
+        return rng.integers(0, self.pool_size, size=(person_num, len(self.year_day_types)))
+
+    def assemble_years(
+        self,
+        id_person_type: int,
+        id_teleworking_type: int,
+        day_refs: np.ndarray,
+        day_types: Optional[np.ndarray] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        :param day_refs: day of the pool of each day of the year of each person (persons x days), see get_day_refs
+        :param day_types: id_day_type of each day of the year, see get_year_day_types
+        :return: activity_profile, technology_profile and location of each person (persons x days * 144 timeslots)
+        """
+        day_types = day_types if day_types is not None else self.year_day_types
+        p = np.searchsorted(self.person_types, id_person_type)
+        w = np.searchsorted(self.teleworking_types, id_teleworking_type)
+        d = np.searchsorted(self.day_types, day_types)
+        return {
+            name: getattr(self, array_name)[p, w, d, day_refs].reshape(len(day_refs), -1)
+            for name, array_name in [
+                ("activity_profile", "activity"), ("technology_profile", "technology"), ("location", "location")
+            ]
+        }
+
+    def assemble_year(
+        self,
+        id_person_type: int,
+        id_teleworking_type: int,
+        rng: np.random.Generator
+    ) -> Dict[str, np.ndarray]:
+        """profiles of one person-year, as keyword arguments of Person"""
+        years = self.assemble_years(id_person_type, id_teleworking_type, self.get_day_refs(1, rng))
+        return {name: profile[0] for name, profile in years.items()}
@@ -1,5 +1,6 @@
 from typing import List, Optional, TYPE_CHECKING
-import random
+
+import numpy as np
 import pandas as pd
 
 if TYPE_CHECKING:
@@ -8,62 +9,55 @@ if TYPE_CHECKING:
 
 class Household:
 
-    def __init__(self, scenario: "BehaviorScenario", id_household_type: int):
+    def __init__(self, scenario: "BehaviorScenario", id_household_type: int,
+                 rng: Optional[np.random.Generator] = None):
+        """
+        :param rng: random generator of the member samples, a generator with random seed if None
+        """
         self.scenario = scenario
         self.id_household_type = id_household_type
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.household_members: List[str] = []
 
     def setup_household_members(self, household_df: pd.DataFrame, person_sample_size: int = 1):
         for index, row in household_df.iterrows():
             for _ in range(0, row["value"]):
-                self.household_members.append(
-                    f'p{row["id_person_type"]}t{row["id_teleworking_type"]}s{random.randint(1, person_sample_size)}'
-                )
+                sample = self.rng.integers(1, person_sample_size, endpoint=True)
+                self.household_members.append(f'p{row["id_person_type"]}t{row["id_teleworking_type"]}s{sample}')
+
+    def get_member_profiles(self, profile: str, dtype=None) -> np.ndarray:
+        """
+        :param profile: "activity", "technology", "appliance_electricity", "hot_water" or "location"
+        :return: the profiles of the members (members x 52,560 timeslots)
+        """
+        return np.stack([np.asarray(self.scenario.person_profiles[f'{profile}_{member}'], dtype=dtype)
+                         for member in self.household_members])
+
+    @staticmethod
+    def to_hourly_mean(member_profiles: np.ndarray) -> np.ndarray:
+        """mean of the six 10-minute timeslots of each hour (members x 8760)"""
+        return member_profiles.reshape(len(member_profiles), -1, 6).sum(axis=2) / member_profiles.dtype.type(6)
 
     def aggregate_household_member_profiles(self):
         self.appliance_electricity_demand = self.aggregate_household_demand("appliance_electricity")
         self.hot_water_demand = self.aggregate_household_demand("hot_water")
         self.occupancy = self.aggregate_location()
 
-    def aggregate_household_demand(self, end_use: str) -> List[float]:
-        household_demand = [0] * 8760
-        for member in self.household_members:
-            member_demand = self.scenario.person_profiles[f'{end_use}_{member}'].to_numpy()
-            for hour in range(0, 8760):
-                household_demand[hour] += member_demand[hour * 6:hour * 6 + 6].sum()/6
-        return household_demand
+    def aggregate_household_demand(self, end_use: str) -> np.ndarray:
+        return self.to_hourly_mean(self.get_member_profiles(end_use, dtype=float)).sum(axis=0)
 
-    def aggregate_location(self) -> List[int]:
-        occupancy = [0] * 8760
-        for hour in range(0, 8760):
-            total_occupancy = 0
-            for member in self.household_members:
-                member_location = self.scenario.person_profiles[f'location_{member}'].to_numpy(dtype='float32')
-                total_occupancy += member_location[hour * 6:hour * 6 + 6].sum()/6
-            if total_occupancy > 0.5:
-                occupancy[hour] = 1
-        return occupancy
+    def aggregate_location(self) -> np.ndarray:
+        total_occupancy = self.to_hourly_mean(self.get_member_profiles("location", dtype="float32")).sum(axis=0)
+        return (total_occupancy > 0.5).astype(int)
 
     def add_lighting_electricity_demand(self):
-
-        def household_is_asleep(hour):
-            asleep = True
-            for member in self.household_members:
-                member_id_activity = self.scenario.person_profiles[f'activity_{member}'].to_numpy(dtype='float32')
-                if member_id_activity[hour * 6] != 1:
-                    asleep = False
-            return asleep
-
-        lighting_power = self.scenario.get_technology_power(36)
-        for hour in range(0, 8760):
-            if self.occupancy[hour] == 1 and hour % 24 > 15 and household_is_asleep(hour):
-                self.appliance_electricity_demand[hour] += lighting_power
+        # the lights are on in the evening if the household is at home and all members sleep at the start of the hour
+        asleep = (self.get_member_profiles("activity")[:, ::6] == 1).all(axis=0)
+        evening = np.arange(len(self.occupancy)) % 24 > 15
+        lighting = (self.occupancy == 1) & evening & asleep
+        self.appliance_electricity_demand[lighting] += self.scenario.get_technology_power(36)
 
     def add_base_appliance_electricity_demand(self):
         modem_power = self.scenario.get_technology_power(35)
         refrigerator_power = self.scenario.get_technology_power(37)
-        for hour in range(0, 8760):
-            self.appliance_electricity_demand[hour] += (modem_power + refrigerator_power)
-
-
-
+        self.appliance_electricity_demand += (modem_power + refrigerator_power)
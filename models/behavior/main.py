@@ -1,90 +1,325 @@
-import os.path
+import math
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from joblib import Parallel
+from joblib import delayed
 from tqdm import tqdm
+from models.behavior.day_library import PersonDayLibrary
 from models.behavior.household import Household
+from models.behavior.markov import get_table_hash
 from models.behavior.person import Person
+from models.behavior.profile_library import ProfileLibrary
+from models.behavior.profile_store import HouseholdKey
+from models.behavior.profile_store import PersonKey
+from models.behavior.profile_store import get_person_mark
+from models.behavior.profile_store import parse_person_mark
 from models.behavior.scenario import BehaviorScenario
 from utils.config import Config
+from utils.db import DB
 from utils.db import create_db_conn
 from utils.func import get_logger
-from utils.func import get_time_cols_hour
-from utils.func import get_time_cols_10min
+from utils.profiler import ScenarioProfiler
+from utils.profiler import profile_scenario
 from utils.tables import InputTables
-from utils.tables import OutputTables
 
 logger = get_logger(__name__)
 PERSON_SAMPLE_SIZE = 5
 HOUSEHOLD_SAMPLE_SIZE = 1
+# default number of persons or households that are kept in memory before they are written to the store
+PROFILE_CHUNK_SIZE = 100
+# first element of the spawn key of the random streams, see get_rng
+PERSON_STREAM = 1
+HOUSEHOLD_STREAM = 2
+DAY_LIBRARY_STREAM = 3
+# version of the person profiles in the profile library, to be increased when their generation (markov, technology,
+# person) or PERSON_PROFILE_TYPES change, so that profiles of an older version are not reused
+PERSON_PROFILE_VERSION = 1
 
 
-def gen_person_profiles(config: "Config"):
-    person_profiles = {}
+def get_rng(entropy: int, *key: int) -> np.random.Generator:
+    """independent random stream of the key, derived from the entropy of the master seed"""
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=key))
+
+
+def setup_person_day_library(scenario: "BehaviorScenario", day_pool_size: int, entropy: int) -> "PersonDayLibrary":
+    """
+    Loads or simulates the pool of person-days (see PersonDayLibrary), which is cached next to the project database
+    and simulated again when the parameters, pool size or seed change.
+    :param scenario: scenario with the person activity data set up
+    """
+    return PersonDayLibrary.load_or_build(
+        path=os.path.join(scenario.config.output, f"{scenario.config.project_name}_PersonDayLibrary.npz"),
+        scenario=scenario,
+        pool_size=day_pool_size,
+        entropy=entropy,
+        rng=get_rng(entropy, DAY_LIBRARY_STREAM)
+    )
+
+
+def get_person_profile_key(
+    db: "DB",
+    seed: int,
+    person_sample_size: int,
+    day_pool_size: Optional[int] = None
+) -> str:
+    """
+    Key of the person profiles in a ProfileLibrary: hash of the behavior parameter and ID tables, the person
+    scenarios and the generation settings, which are all that the profiles depend on.
+    """
+    table_names = sorted(
+        table.name for table in InputTables if table.name.startswith(("BehaviorParam_", "BehaviorID_"))
+    )
+    tables = [db.read_dataframe(table_name) for table_name in table_names + [InputTables.BehaviorScenario_Person.name]]
+    settings = pd.DataFrame({
+        "seed": [seed],
+        "person_sample_size": [person_sample_size],
+        "day_pool_size": [day_pool_size or 0],
+        "version": [PERSON_PROFILE_VERSION],
+    })
+    return get_table_hash(tables + [settings])
+
+
+def gen_person_profile(
+    scenario: "BehaviorScenario",
+    person_key: "PersonKey",
+    entropy: int,
+    profiler: Optional["ScenarioProfiler"] = None,
+    day_library: Optional["PersonDayLibrary"] = None
+) -> Dict[str, np.ndarray]:
+    """
+    :param day_library: if provided, the activities, technologies and locations of the person are assembled from
+            days of the library instead of being simulated
+    """
+    id_person_type, id_teleworking_type, sample = person_key
+    with profile_scenario(profiler, get_person_mark(person_key)):
+        rng = get_rng(entropy, PERSON_STREAM, id_person_type, id_teleworking_type, sample)
+        person = Person(
+            scenario=scenario,
+            id_person_type=id_person_type,
+            id_teleworking_type=id_teleworking_type,
+            rng=rng,
+            **(day_library.assemble_year(id_person_type, id_teleworking_type, rng) if day_library is not None else {})
+        )
+        person.setup()
+    return {
+        "activity": person.activity_profile,
+        "technology": person.technology_profile,
+        "appliance_electricity": person.appliance_electricity_demand,
+        "hot_water": person.hot_water_demand,
+        "location": person.location,
+    }
+
+
+def get_person_key(person_types: List[Tuple[int, int]], person_sample_size: int, index: int) -> "PersonKey":
+    """person key at position index of the persons, ordered by person scenario and sample"""
+    id_person_type, id_teleworking_type = person_types[index // person_sample_size]
+    return id_person_type, id_teleworking_type, index % person_sample_size + 1
+
+
+def gen_person_profile_chunks(
+    scenario: "BehaviorScenario",
+    person_types: List[Tuple[int, int]],
+    person_sample_size: int,
+    start: int,
+    end: int,
+    entropy: int,
+    chunk_size: int,
+    profiler: Optional["ScenarioProfiler"] = None,
+    day_library: Optional["PersonDayLibrary"] = None
+) -> Iterator[Dict["PersonKey", Dict[str, np.ndarray]]]:
+    """
+    Generates the profiles of the persons at positions start to end and yields them in chunks of chunk_size
+    persons, so that only one chunk is kept in memory.
+    """
+    for chunk_start in range(start, end, chunk_size):
+        yield {
+            person_key: gen_person_profile(
+                scenario, person_key, entropy=entropy, profiler=profiler, day_library=day_library
+            )
+            for person_key in (get_person_key(person_types, person_sample_size, index)
+                               for index in range(chunk_start, min(chunk_start + chunk_size, end)))
+        }
+
+
+def gen_person_profile_task(
+    config: "Config",
+    person_types: List[Tuple[int, int]],
+    person_sample_size: int,
+    start: int,
+    end: int,
+    entropy: int,
+    chunk_size: int,
+    profiler: Optional["ScenarioProfiler"] = None,
+    day_pool_size: Optional[int] = None
+):
+    """generates the profiles of the persons in a worker process and writes them to the person profile store"""
+    scenario = BehaviorScenario(config=config)
+    scenario.setup_person_activity_data()
+    day_library = setup_person_day_library(scenario, day_pool_size, entropy) if day_pool_size is not None else None
+    store = scenario.get_person_profile_store()
+    for chunk in gen_person_profile_chunks(
+        scenario, person_types, person_sample_size, start, end, entropy, chunk_size, profiler, day_library
+    ):
+        store.write(chunk)
+
+
+def gen_person_profiles(
+    config: "Config",
+    profiler: Optional["ScenarioProfiler"] = None,
+    seed: Optional[int] = None,
+    n_jobs: int = 1,
+    person_sample_size: int = PERSON_SAMPLE_SIZE,
+    chunk_size: int = PROFILE_CHUNK_SIZE,
+    day_pool_size: Optional[int] = None,
+    profile_library: Optional["ProfileLibrary"] = None
+):
+    """
+    The profiles are written to the PersonProfileStore <output>/BehaviorResult_PersonProfiles.
+    :param profiler: if provided, the person samples selected by the profiler (identified as
+            p{id_person_type}t{id_teleworking_type}s{sample}) are profiled. With n_jobs > 1, every_nth counts
+            the samples of each worker.
+    :param seed: master seed. Each person sample draws from its own random stream, derived from the seed and
+            (id_person_type, id_teleworking_type, sample), so the profiles of a seed do not depend on n_jobs.
+    :param n_jobs: number of worker processes that generate the profiles
+    :param person_sample_size: number of samples of each person scenario
+    :param chunk_size: number of persons that are generated before they are written to the store,
+            each process keeps at most one chunk in memory
+    :param day_pool_size: if provided, day_pool_size days are simulated for each (person type, teleworking type,
+            day type) once, and the person-years are assembled from days drawn from this pool (see PersonDayLibrary)
+    :param profile_library: library shared by the projects. If it has the profiles of the same parameter tables,
+            person scenarios, seed and sizes, they are copied from the library instead of being generated, otherwise
+            the generated profiles are added to it. Only used with a seed, as profiles without one are not reproducible.
+    """
     db = create_db_conn(config)
     scenario = BehaviorScenario(config=config)
+    store = scenario.get_person_profile_store()
+    profile_key = None
+    if profile_library is not None and seed is not None:
+        profile_key = get_person_profile_key(db, seed, person_sample_size, day_pool_size)
+        if profile_library.get(profile_key, store.folder):
+            return
+    store.clear()
+    # compiles (or loads) the activity tensors once before the workers load them from the cache
     scenario.setup_person_activity_data()
+    entropy = np.random.SeedSequence(seed).entropy
+    # simulates the day library once before the workers load it from the cache
+    day_library = setup_person_day_library(scenario, day_pool_size, entropy) if day_pool_size is not None else None
     person_scenarios = db.read_dataframe(InputTables.BehaviorScenario_Person.name)
-    for index, row in tqdm(person_scenarios.iterrows(), total=len(person_scenarios), desc="generating person profiles"):
-        for sample in range(1, PERSON_SAMPLE_SIZE + 1):
-            person = Person(
-                scenario=scenario,
-                id_person_type=row["id_person_type"],
-                id_teleworking_type=row["id_teleworking_type"]
+    person_types = [
+        (int(id_person_type), int(id_teleworking_type)) for id_person_type, id_teleworking_type in
+        zip(person_scenarios["id_person_type"], person_scenarios["id_teleworking_type"])
+    ]
+    person_num = len(person_types) * person_sample_size
+    if n_jobs == 1:
+        with tqdm(total=person_num, desc="generating person profiles") as progress:
+            for chunk in gen_person_profile_chunks(
+                scenario, person_types, person_sample_size, 0, person_num, entropy, chunk_size, profiler, day_library
+            ):
+                store.write(chunk)
+                progress.update(len(chunk))
+    else:
+        task_size = math.ceil(person_num / n_jobs)
+        Parallel(n_jobs=n_jobs)(
+            delayed(gen_person_profile_task)(
+                config, person_types, person_sample_size, start, min(start + task_size, person_num), entropy,
+                chunk_size, profiler, day_pool_size
             )
-            person.setup()
-            mark = f"p{person.id_person_type}t{person.id_teleworking_type}s{sample}"
-            person_profiles[f"activity_{mark}"] = person.activity_profile
-            person_profiles[f"technology_{mark}"] = person.technology_profile
-            person_profiles[f"appliance_electricity_{mark}"] = person.appliance_electricity_demand
-            person_profiles[f"hot_water_{mark}"] = person.hot_water_demand
-            person_profiles[f"location_{mark}"] = person.location
-
-    person_profiles_df = pd.DataFrame(person_profiles)
-    person_profiles_df = pd.concat([get_time_cols_10min(), person_profiles_df], axis=1)
-    person_profiles_df.to_csv(
-        os.path.join(config.output, f'{OutputTables.BehaviorResult_PersonProfiles.name}.csv'),
-        index=False
-    )
-    db.write_dataframe(
-        table_name=OutputTables.BehaviorResult_PersonProfiles.name,
-        data_frame=person_profiles_df,
-        if_exists="replace"
-    )
+            for start in range(0, person_num, task_size)
+        )
+    if profile_key is not None:
+        profile_library.put(profile_key, store.folder)
 
 
-def gen_household_profiles(config: "Config"):
+def gen_household_profile_chunk(
+    scenario: "BehaviorScenario",
+    household_scenarios: pd.DataFrame,
+    household_keys: List["HouseholdKey"],
+    entropy: int,
+    person_sample_size: int,
+    day_library: Optional["PersonDayLibrary"] = None
+) -> Dict["HouseholdKey", Dict[str, np.ndarray]]:
+    households = []
+    for id_household_type, sample in household_keys:
+        household = Household(
+            scenario=scenario,
+            id_household_type=id_household_type,
+            rng=get_rng(entropy, HOUSEHOLD_STREAM, id_household_type, sample)
+        )
+        household.setup_household_members(
+            household_df=household_scenarios.loc[household_scenarios["id_household_type"] == id_household_type],
+            person_sample_size=person_sample_size
+        )
+        households.append(household)
+    persons = {parse_person_mark(member) for household in households for member in household.household_members}
+    if day_library is None:
+        # only the profiles of the drawn members that the households of the chunk use are read
+        scenario.load_person_profiles(
+            persons=persons,
+            profile_names=["activity", "appliance_electricity", "hot_water", "location"]
+        )
+    else:
+        scenario.person_profiles = {
+            f"{name}_{get_person_mark(person_key)}": profile for person_key in persons
+            for name, profile in gen_person_profile(scenario, person_key, entropy, day_library=day_library).items()
+        }
     household_profiles = {}
+    for household_key, household in zip(household_keys, households):
+        household.aggregate_household_member_profiles()
+        household.add_lighting_electricity_demand()
+        household.add_base_appliance_electricity_demand()
+        household_profiles[household_key] = {
+            "appliance_electricity": household.appliance_electricity_demand,
+            "hot_water": household.hot_water_demand,
+            "occupancy": household.occupancy,
+        }
+    return household_profiles
+
+
+def gen_household_profiles(
+    config: "Config",
+    seed: Optional[int] = None,
+    person_sample_size: int = PERSON_SAMPLE_SIZE,
+    household_sample_size: int = HOUSEHOLD_SAMPLE_SIZE,
+    chunk_size: int = PROFILE_CHUNK_SIZE,
+    day_pool_size: Optional[int] = None
+):
+    """
+    The profiles are written to the HouseholdProfileStore <output>/BehaviorResult_HouseholdProfiles.
+    :param seed: master seed, each household sample draws its members from its own random stream
+    :param person_sample_size: number of samples of each person scenario that gen_person_profiles generated,
+            the members are drawn from them
+    :param household_sample_size: number of samples of each household type
+    :param chunk_size: number of households that are generated (with their members' profiles in memory)
+            before they are written to the store
+    :param day_pool_size: if provided, the members are assembled from the person day library with this pool size
+            (as gen_person_profiles with the same seed and day_pool_size would generate them) instead of being read
+            from the person profile store. Since a person-year only takes drawing 365 days of the pool, the members
+            can be drawn from a person_sample_size much larger than the number of generated person profiles.
+    """
+    entropy = np.random.SeedSequence(seed).entropy
     db = create_db_conn(config)
     scenario = BehaviorScenario(config=config)
-    scenario.load_person_profiles()
+    store = scenario.get_household_profile_store()
+    store.clear()
+    day_library = None
+    if day_pool_size is not None:
+        scenario.setup_person_activity_data()
+        day_library = setup_person_day_library(scenario, day_pool_size, entropy)
     household_scenarios = db.read_dataframe(InputTables.BehaviorScenario_Household.name)
-    household_type_ids = household_scenarios["id_household_type"].unique()
-    for id_household_type in tqdm(household_type_ids, total=len(household_type_ids), desc="generating household profiles"):
-        for sample in range(1, HOUSEHOLD_SAMPLE_SIZE + 1):
-            household = Household(
-                scenario=scenario,
-                id_household_type=id_household_type,
-            )
-            household.setup_household_members(
-                household_df=household_scenarios.loc[household_scenarios["id_household_type"] == id_household_type],
-                person_sample_size=PERSON_SAMPLE_SIZE
-            )
-            household.aggregate_household_member_profiles()
-            household.add_lighting_electricity_demand()
-            household.add_base_appliance_electricity_demand()
-            mark = f"ht{household.id_household_type}s{sample}"
-            household_profiles[f"appliance_electricity_{mark}"] = household.appliance_electricity_demand
-            household_profiles[f"hot_water_{mark}"] = household.hot_water_demand
-            household_profiles[f"occupancy_{mark}"] = household.occupancy
-
-    household_profiles_df = pd.DataFrame(household_profiles)
-    household_profiles_df = pd.concat([get_time_cols_hour(), household_profiles_df], axis=1)
-    household_profiles_df.to_csv(
-        os.path.join(config.output, f'{OutputTables.BehaviorResult_HouseholdProfiles.name}.csv'),
-        index=False
-    )
-    db.write_dataframe(
-        table_name=OutputTables.BehaviorResult_HouseholdProfiles.name,
-        data_frame=household_profiles_df,
-        if_exists="replace"
-    )
+    household_type_ids = [
+        int(id_household_type) for id_household_type in household_scenarios["id_household_type"].unique()
+    ]
+    household_num = len(household_type_ids) * household_sample_size
+    with tqdm(total=household_num, desc="generating household profiles") as progress:
+        for start in range(0, household_num, chunk_size):
+            household_keys = [
+                (household_type_ids[index // household_sample_size], index % household_sample_size + 1)
+                for index in range(start, min(start + chunk_size, household_num))
+            ]
+            store.write(gen_household_profile_chunk(
+                scenario, household_scenarios, household_keys, entropy, person_sample_size, day_library
+            ))
+            progress.update(len(household_keys))
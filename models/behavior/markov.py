@@ -0,0 +1,367 @@
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.func import day2weekday
+from utils.func import get_logger
+
+logger = get_logger(__name__)
+
+TIMESLOT_NUM = 144
+DAY_NUM = 365
+WORKING_ACTIVITY = 11
+# students and retired persons: "working" is replaced with an activity drawn from the TUS profiles of the timeslot,
+# because the Markov parameters fall back to other person types where these have too little data
+NON_WORKING_PERSON_TYPES = [3, 4]
+
+
+def get_table_hash(tables: List[pd.DataFrame]) -> str:
+    """hash of the contents (columns and values) of the tables"""
+    sha = hashlib.sha1()
+    for df in tables:
+        sha.update(",".join(str(column) for column in df.columns).encode())
+        sha.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def get_value_index(values: pd.Series, sorted_values: np.ndarray) -> np.ndarray:
+    """position of each value in sorted_values, -1 for values that are not in sorted_values"""
+    values = values.to_numpy()
+    index = np.clip(np.searchsorted(sorted_values, values), 0, len(sorted_values) - 1)
+    return np.where(sorted_values[index] == values, index, -1)
+
+
+def compile_cdf(
+    df: pd.DataFrame,
+    keys: List[str],
+    key_values: Dict[str, np.ndarray],
+    outcome: str,
+    outcome_values: np.ndarray,
+    weight: Optional[str] = None,
+    min_key_num: int = 1,
+    duplicates: str = "last"
+) -> np.ndarray:
+    """
+    Compiles the distributions of `outcome` for all combinations of the keys into one dense array of cumulative
+    probabilities, of shape (len(key_values[key]) for key in keys) + (len(outcome_values),).
+    As in filter_dataframe_dynamic, the keys are ranked from most to least important: if the table has no rows
+    for a combination, the least important keys are dropped until it has. The tables are grouped once per
+    fallback level instead of filtered once per combination.
+    :param key_values: sorted values of each key, which are the positions along the axes of the array
+    :param weight: column of the (unnormalized) probabilities, each row counts 1 if None
+    :param min_key_num: number of keys that are never dropped. Combinations that have no rows even then have a
+            cdf of zeros.
+    :param duplicates: "last" to keep the weight of the last row of an outcome in a group (like a dict built
+            with iterrows), "sum" to add the weights
+    """
+    shape = [len(key_values[key]) for key in keys]
+    outcome_num = len(outcome_values)
+    key_index = [get_value_index(df[key], key_values[key]) for key in keys]
+    outcome_index = get_value_index(df[outcome], outcome_values)
+    weights = df[weight].to_numpy(dtype=float) if weight is not None else np.ones(len(df))
+    in_grid = np.all([index >= 0 for index in key_index], axis=0)
+
+    result = np.zeros(shape + [outcome_num])
+    filled = np.zeros(shape, dtype=bool)
+    for key_num in range(len(keys), min_key_num - 1, -1):
+        level_shape = shape[:key_num]
+        group = np.ravel_multi_index([index[in_grid] for index in key_index[:key_num]], level_shape)
+        exists = np.zeros(int(np.prod(level_shape)), dtype=bool)
+        exists[group] = True
+        rows = outcome_index[in_grid] >= 0
+        level_weights = pd.Series(weights[in_grid][rows]).groupby(
+            [group[rows], outcome_index[in_grid][rows]], sort=False
+        ).agg(duplicates)
+        level_result = np.zeros((len(exists), outcome_num))
+        level_result[level_weights.index.get_level_values(0), level_weights.index.get_level_values(1)] = \
+            level_weights.to_numpy()
+        broadcast_shape = level_shape + [1] * (len(keys) - key_num)
+        take = ~filled & exists.reshape(broadcast_shape)
+        result = np.where(take[..., None], level_result.reshape(broadcast_shape + [outcome_num]), result)
+        filled |= take
+
+    total = result.sum(axis=-1, keepdims=True)
+    cdf = np.divide(np.cumsum(result, axis=-1), total, out=np.zeros_like(result), where=total > 0)
+    cdf[..., -1] = np.where(total[..., 0] > 0, 1.0, 0.0)
+    return cdf
+
+
+def sample_cdf(cdf: np.ndarray, rand: np.ndarray) -> np.ndarray:
+    """
+    Inverse-CDF sampling: index of the first outcome whose cumulative probability is >= rand (as func.dict_sample).
+    :param cdf: cumulative probabilities (..., outcomes), broadcast against rand
+    """
+    return np.minimum((cdf < np.asarray(rand)[..., None]).sum(axis=-1), cdf.shape[-1] - 1)
+
+
+def sample_cdf_rows(cdf: np.ndarray, rows: np.ndarray, rand: np.ndarray) -> np.ndarray:
+    """
+    Inverse-CDF sampling from selected rows of a cdf array by a vectorized binary search, which reads
+    log2(outcomes) values per draw instead of the whole row.
+    :param cdf: cumulative probabilities (rows, outcomes)
+    """
+    values = cdf.reshape(-1)
+    low = rows * cdf.shape[1]
+    high = low + cdf.shape[1] - 1
+    for _ in range(int(np.ceil(np.log2(cdf.shape[1])))):
+        middle = (low + high) >> 1
+        above = values.take(middle) < rand
+        low = np.where(above, middle + 1, low)
+        high = np.where(above, high, middle)
+    return low - rows * cdf.shape[1]
+
+
+def get_year_day_types() -> np.ndarray:
+    return np.array([day2weekday(day)[1] for day in range(1, DAY_NUM + 1)])
+
+
+class ActivityTensors:
+
+    array_names = ["activity_start_cdf", "period_activity_cdf", "activity_duration_cdf", "activity_now_cdf"]
+
+    def __init__(
+        self,
+        key: str,
+        person_types: np.ndarray,
+        day_types: np.ndarray,
+        activities: np.ndarray,
+        durations: np.ndarray,
+        activity_start_cdf: np.ndarray,
+        period_activity_cdf: np.ndarray,
+        activity_duration_cdf: np.ndarray,
+        activity_now_cdf: np.ndarray,
+    ):
+        """
+        Cumulative probabilities of the activity Markov chain. The axes are indexed by the position of the ID in
+        person_types, day_types and activities (id - 1 for IDs counting from 1) and by timeslot - 1:
+        - activity_start_cdf: (person type, day type, activity)
+        - period_activity_cdf: (person type, day type, timeslot, activity), activity shares of the TUS profiles
+        - activity_duration_cdf: (person type, day type, activity, timeslot, duration), durations in `durations`
+        - activity_now_cdf: (person type, day type, activity before, timeslot, activity now)
+        :param key: hash of the parameter tables the tensors were compiled from
+        """
+        self.key = key
+        self.person_types = person_types
+        self.day_types = day_types
+        self.activities = activities
+        self.durations = durations
+        self.activity_start_cdf = activity_start_cdf
+        self.period_activity_cdf = period_activity_cdf
+        self.activity_duration_cdf = activity_duration_cdf
+        self.activity_now_cdf = activity_now_cdf
+
+    @staticmethod
+    def get_key(tables: List[pd.DataFrame]) -> str:
+        return get_table_hash(tables)
+
+    @classmethod
+    def compile(
+        cls,
+        person_types: np.ndarray,
+        day_types: np.ndarray,
+        activities: np.ndarray,
+        tus_profile: pd.DataFrame,
+        start_prob: pd.DataFrame,
+        duration_prob: pd.DataFrame,
+        change_prob: pd.DataFrame,
+    ) -> "ActivityTensors":
+        """the fallback keys of each table are the ones BehaviorScenario used with filter_dataframe_dynamic"""
+        person_types, day_types, activities = (np.sort(np.asarray(ids)) for ids in (person_types, day_types, activities))
+        timeslots = np.arange(1, TIMESLOT_NUM + 1)
+        durations = np.sort(duration_prob["duration"].unique())
+        key_values = {
+            "id_person_type": person_types,
+            "id_day_type": day_types,
+            "id_activity": activities,
+            "id_activity_before": activities,
+            "t": timeslots,
+        }
+        activity_start_cdf = compile_cdf(
+            start_prob, keys=["id_day_type", "id_person_type"], key_values=key_values,
+            outcome="id_activity", outcome_values=activities, weight="probability"
+        ).transpose(1, 0, 2)
+        tus_activities = tus_profile.melt(
+            id_vars=["id_person_type", "id_day_type"], value_vars=[f"t{t}" for t in timeslots],
+            var_name="t", value_name="id_activity"
+        )
+        tus_activities["t"] = tus_activities["t"].str[1:].astype(int)
+        period_activity_cdf = compile_cdf(
+            tus_activities, keys=["t", "id_day_type", "id_person_type"], key_values=key_values,
+            outcome="id_activity", outcome_values=activities, min_key_num=2, duplicates="sum"
+        ).transpose(2, 1, 0, 3)
+        activity_duration_cdf = compile_cdf(
+            duration_prob, keys=["id_activity", "t", "id_day_type", "id_person_type"], key_values=key_values,
+            outcome="duration", outcome_values=durations, weight="probability"
+        ).transpose(3, 2, 0, 1, 4)
+        activity_now_cdf = compile_cdf(
+            change_prob, keys=["id_activity_before", "t", "id_day_type", "id_person_type"], key_values=key_values,
+            outcome="id_activity_now", outcome_values=activities, weight="probability"
+        ).transpose(3, 2, 0, 1, 4)
+        return cls(
+            key=cls.get_key([tus_profile, start_prob, duration_prob, change_prob]),
+            person_types=person_types,
+            day_types=day_types,
+            activities=activities,
+            durations=durations,
+            activity_start_cdf=activity_start_cdf,
+            period_activity_cdf=period_activity_cdf,
+            activity_duration_cdf=activity_duration_cdf,
+            activity_now_cdf=activity_now_cdf,
+        )
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            key=np.array(self.key),
+            person_types=self.person_types,
+            day_types=self.day_types,
+            activities=self.activities,
+            durations=self.durations,
+            **{name: getattr(self, name) for name in self.array_names}
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ActivityTensors":
+        with np.load(path) as arrays:
+            return cls(key=str(arrays["key"]), **{name: arrays[name] for name in arrays.files if name != "key"})
+
+    @classmethod
+    def load_or_compile(
+        cls,
+        path: str,
+        person_types: np.ndarray,
+        day_types: np.ndarray,
+        activities: np.ndarray,
+        tus_profile: pd.DataFrame,
+        start_prob: pd.DataFrame,
+        duration_prob: pd.DataFrame,
+        change_prob: pd.DataFrame,
+    ) -> "ActivityTensors":
+        """loads the tensors from path if they were compiled from the same tables, otherwise compiles and saves them"""
+        if os.path.exists(path):
+            tensors = cls.load(path)
+            if tensors.key == cls.get_key([tus_profile, start_prob, duration_prob, change_prob]) and \
+                    np.array_equal(tensors.person_types, np.sort(person_types)) and \
+                    np.array_equal(tensors.day_types, np.sort(day_types)) and \
+                    np.array_equal(tensors.activities, np.sort(activities)):
+                return tensors
+        tensors = cls.compile(person_types, day_types, activities, tus_profile, start_prob, duration_prob, change_prob)
+        try:
+            tensors.save(path)
+        except OSError as e:
+            logger.warning(f"Activity tensors are not cached: {e}")
+        return tensors
+
+
+class ActivitySampler:
+
+    def __init__(self, tensors: "ActivityTensors", rng: Optional[np.random.Generator] = None,
+                 chunk_day_num: int = 50_000):
+        """
+        Samples the activity sequences of many person-days at once: in each step, all days that are not complete
+        yet draw their next activity and its duration by inverse-CDF lookups in the ActivityTensors. The draws
+        follow the same chain as sampling one person-day at a time with the BehaviorScenario dicts.
+        :param rng: default random generator of the draws, a generator with random seed if None
+        :param chunk_day_num: number of days that are sampled together, which bounds the memory of the temporary arrays
+        """
+        self.tensors = tensors
+        self.chunk_day_num = chunk_day_num
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.activity_num = len(tensors.activities)
+        self.person_types = list(tensors.person_types)
+        self.non_working_person_types = [self.person_types.index(id_person_type) for id_person_type in
+                                         NON_WORKING_PERSON_TYPES if id_person_type in self.person_types]
+        self.working_activity = list(tensors.activities).index(WORKING_ACTIVITY)
+        day_type_num = len(tensors.day_types)
+        self.start_cdf = tensors.activity_start_cdf.reshape(-1, self.activity_num)
+        self.period_cdf = tensors.period_activity_cdf.reshape(-1, self.activity_num)
+        self.duration_cdf = tensors.activity_duration_cdf.reshape(-1, len(tensors.durations))
+        self.now_cdf = tensors.activity_now_cdf.reshape(-1, self.activity_num)
+        # row of (person type, day type) in the flattened arrays
+        self.person_day_rows = np.arange(len(self.person_types) * day_type_num).reshape(-1, day_type_num)
+
+    def replace_working(self, activity: np.ndarray, person_day: np.ndarray, is_non_working: np.ndarray,
+                        timeslot: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        replace = np.flatnonzero(is_non_working & (activity == self.working_activity))
+        if len(replace) > 0:
+            rows = person_day[replace] * TIMESLOT_NUM + timeslot[replace] - 1
+            activity[replace] = sample_cdf_rows(self.period_cdf, rows, rng.random(len(replace)))
+        return activity
+
+    def draw_duration(self, person_day: np.ndarray, activity: np.ndarray, timeslot: np.ndarray,
+                      rng: np.random.Generator) -> np.ndarray:
+        rows = (person_day * self.activity_num + activity) * TIMESLOT_NUM + timeslot - 1
+        return self.tensors.durations[sample_cdf_rows(self.duration_cdf, rows, rng.random(len(rows)))]
+
+    def sample_days(
+        self,
+        person_types: np.ndarray,
+        day_types: np.ndarray,
+        rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+        """
+        :param person_types: id_person_type of each day
+        :param day_types: id_day_type of each day
+        :param rng: random generator of the draws, the generator of the sampler if None
+        :return: activity IDs of each day (days x 144 timeslots)
+        """
+        person_index = np.searchsorted(self.tensors.person_types, person_types)
+        person_day = self.person_day_rows[person_index, np.searchsorted(self.tensors.day_types, day_types)]
+        is_non_working = np.isin(person_index, self.non_working_person_types)
+        rng = rng if rng is not None else self.rng
+        activities = np.empty((len(person_day), TIMESLOT_NUM), dtype=np.int8)
+        for start in range(0, len(person_day), self.chunk_day_num):
+            chunk = slice(start, start + self.chunk_day_num)
+            activities[chunk] = self.sample_chunk(person_day[chunk], is_non_working[chunk], rng)
+        return activities
+
+    def sample_chunk(self, person_day: np.ndarray, is_non_working: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        day_num = len(person_day)
+        # each activity is written to the timeslot where it starts, the other timeslots are filled at the end
+        starts = np.zeros((day_num, TIMESLOT_NUM), dtype=np.int8)
+        is_start = np.zeros((day_num, TIMESLOT_NUM), dtype=bool)
+
+        first_slot = np.ones(day_num, dtype=np.int64)
+        activity = sample_cdf_rows(self.start_cdf, person_day, rng.random(day_num))
+        activity = self.replace_working(activity, person_day, is_non_working, first_slot, rng)
+        starts[:, 0] = activity
+        is_start[:, 0] = True
+        length = np.minimum(self.draw_duration(person_day, activity, first_slot, rng), TIMESLOT_NUM)
+        # the first change is drawn for the timeslot after the start activity, the later ones for the last timeslot
+        # of the previous activity (as in the original one-day loop)
+        timeslot = length + 1
+        days = np.arange(day_num)
+        while True:
+            active = length < TIMESLOT_NUM
+            days, activity, length, timeslot = days[active], activity[active], length[active], timeslot[active]
+            if len(days) == 0:
+                break
+            rows = (person_day[days] * self.activity_num + activity) * TIMESLOT_NUM + timeslot - 1
+            activity = sample_cdf_rows(self.now_cdf, rows, rng.random(len(days)))
+            activity = self.replace_working(activity, person_day[days], is_non_working[days], timeslot, rng)
+            starts[days, length] = activity
+            is_start[days, length] = True
+            length = np.minimum(length + self.draw_duration(person_day[days], activity, timeslot, rng), TIMESLOT_NUM)
+            timeslot = length
+        last_start = np.maximum.accumulate(np.where(is_start, np.arange(TIMESLOT_NUM), 0), axis=1)
+        activities = np.take_along_axis(starts, last_start, axis=1)
+        return self.tensors.activities[activities].astype(np.int8)
+
+    def sample_years(
+        self,
+        id_person_type: int,
+        person_num: int,
+        day_types: Optional[np.ndarray] = None,
+        rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+        """
+        :param day_types: id_day_type of each day of the year, see get_year_day_types
+        :param rng: random generator of the draws, the generator of the sampler if None
+        :return: activity IDs of each person (persons x 365 * 144 timeslots)
+        """
+        day_types = day_types if day_types is not None else get_year_day_types()
+        days = self.sample_days(np.full(person_num * len(day_types), id_person_type), np.tile(day_types, person_num), rng)
+        return days.reshape(person_num, -1)
@@ -0,0 +1,164 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from utils.func import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_LIBRARY_MAX_SIZE = 10 * 1024 ** 3
+
+
+def link_or_copy(source: str, target: str):
+    """the files of a profile store are never modified after they are written, so they can be shared as hard links"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def get_folder_size(folder: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(folder) for name in names)
+
+
+class ProfileLibrary:
+
+    manifest_file_name = "_manifest.json"
+    lock_file_name = "_lock"
+
+    def __init__(
+        self,
+        folder: str,
+        max_size: int = PROFILE_LIBRARY_MAX_SIZE,
+        max_entries: Optional[int] = None,
+        lock_timeout: float = 600,
+        stale_seconds: float = 3600
+    ):
+        """
+        On-disk library of generated profile stores that several projects share. Each entry is the folder of a
+        profile store, identified by a key of everything the profiles were generated from. When the library is
+        larger than max_size (bytes) or has more than max_entries entries, the least recently used ones are removed.
+        The manifest and the entries are changed under a lock file, so that projects can use the library at the
+        same time.
+        :param lock_timeout: seconds to wait for the lock before a TimeoutError is raised
+        :param stale_seconds: age after which a lock file or an unfinished entry (of a killed process) is removed
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self.stale_seconds = stale_seconds
+        self.manifest_path = os.path.join(folder, self.manifest_file_name)
+        self.lock_path = os.path.join(folder, self.lock_file_name)
+
+    def is_stale(self, path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) > self.stale_seconds
+        except OSError:
+            return False
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.folder, exist_ok=True)
+        start = time.time()
+        while True:
+            try:
+                os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                if self.is_stale(self.lock_path):
+                    logger.warning(f"Stale lock of the profile library {self.folder} is removed.")
+                    try:
+                        os.remove(self.lock_path)
+                    except FileNotFoundError:
+                        pass
+                elif time.time() - start > self.lock_timeout:
+                    raise TimeoutError(f"profile library {self.folder} is locked by another process")
+                else:
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            os.remove(self.lock_path)
+
+    def read_manifest(self) -> Dict[str, Dict[str, float]]:
+        """
+        {key: {"size": bytes, "last_used": timestamp}} of the entries. Entry folders that are missing from the
+        manifest are added (with their modification time as last use), so that they are counted and evicted,
+        and unfinished entries of killed processes are removed. Needs the lock.
+        """
+        manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        manifest = {key: entry for key, entry in manifest.items() if os.path.isdir(self.get_entry_folder(key))}
+        for name in os.listdir(self.folder) if os.path.isdir(self.folder) else []:
+            path = os.path.join(self.folder, name)
+            if name in manifest or not os.path.isdir(path):
+                continue
+            if "." in name:
+                # temporary folder of put
+                if self.is_stale(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            manifest[name] = {"size": get_folder_size(path), "last_used": os.path.getmtime(path)}
+        return manifest
+
+    def write_manifest(self, manifest: Dict[str, Dict[str, float]]):
+        os.makedirs(self.folder, exist_ok=True)
+        path = f"{self.manifest_path}.{uuid.uuid4().hex}"
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path, self.manifest_path)
+
+    def get_entry_folder(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def get(self, key: str, target_folder: str) -> bool:
+        """
+        Copies the entry of the key to target_folder, which is replaced.
+        :return: whether the library has an entry of the key
+        """
+        with self.lock():
+            manifest = self.read_manifest()
+            if key not in manifest:
+                self.write_manifest(manifest)
+                return False
+            if os.path.exists(target_folder):
+                shutil.rmtree(target_folder)
+            # under the lock, so that the entry is not evicted while it is copied
+            shutil.copytree(self.get_entry_folder(key), target_folder, copy_function=link_or_copy)
+            manifest[key]["last_used"] = time.time()
+            self.write_manifest(manifest)
+        logger.info(f"Profiles {key} are reused from the profile library {self.folder}.")
+        return True
+
+    def put(self, key: str, source_folder: str):
+        """adds the profiles in source_folder as entry of the key and removes the least recently used entries"""
+        entry_folder = self.get_entry_folder(key)
+        # the entry is copied next to its place first (without the lock), so that an interrupted copy never
+        # becomes an entry
+        os.makedirs(self.folder, exist_ok=True)
+        temp_folder = f"{entry_folder}.{uuid.uuid4().hex}"
+        shutil.copytree(source_folder, temp_folder, copy_function=link_or_copy)
+        with self.lock():
+            if os.path.exists(entry_folder):
+                shutil.rmtree(entry_folder)
+            os.replace(temp_folder, entry_folder)
+            manifest = self.read_manifest()
+            manifest[key] = {"size": get_folder_size(entry_folder), "last_used": time.time()}
+            self.write_manifest(self.evict(manifest))
+
+    def evict(self, manifest: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+        """removes the least recently used entries of the manifest (see read_manifest) until the limits hold"""
+        keys = sorted(manifest.keys(), key=lambda key: manifest[key]["last_used"])
+        while keys and (sum(manifest[key]["size"] for key in keys) > self.max_size or
+                        (self.max_entries is not None and len(keys) > self.max_entries)):
+            key = keys.pop(0)
+            shutil.rmtree(self.get_entry_folder(key), ignore_errors=True)
+            logger.info(f"Profiles {key} are removed from the profile library {self.folder}.")
+        return {key: manifest[key] for key in keys}
@@ -0,0 +1,190 @@
+import os
+import re
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from models.behavior.markov import DAY_NUM
+from models.behavior.markov import TIMESLOT_NUM
+
+YEAR_TIMESLOT_NUM = DAY_NUM * TIMESLOT_NUM
+HOUR_NUM = 8760
+PERSON_PROFILE_TYPES = {
+    "activity": pa.int8(),
+    "technology": pa.int16(),
+    "appliance_electricity": pa.float32(),
+    "hot_water": pa.float32(),
+    "location": pa.int8(),
+}
+PERSON_KEY_TYPES = {
+    "id_teleworking_type": pa.int8(),
+    "sample": pa.int32(),
+}
+HOUSEHOLD_PROFILE_TYPES = {
+    "appliance_electricity": pa.float32(),
+    "hot_water": pa.float32(),
+    "occupancy": pa.int8(),
+}
+HOUSEHOLD_KEY_TYPES = {
+    "sample": pa.int32(),
+}
+# (id_person_type, id_teleworking_type, sample)
+PersonKey = Tuple[int, int, int]
+# (id_household_type, sample)
+HouseholdKey = Tuple[int, int]
+
+
+def get_person_mark(person_key: "PersonKey") -> str:
+    return "p{}t{}s{}".format(*person_key)
+
+
+def parse_person_mark(mark: str) -> "PersonKey":
+    id_person_type, id_teleworking_type, sample = re.fullmatch(r"p(\d+)t(\d+)s(\d+)", mark).groups()
+    return int(id_person_type), int(id_teleworking_type), int(sample)
+
+
+def get_household_mark(household_key: "HouseholdKey") -> str:
+    return "ht{}s{}".format(*household_key)
+
+
+class ProfileStore(ABC):
+
+    partition_column: str = ""
+    key_types: Dict[str, pa.DataType] = {}
+    profile_types: Dict[str, pa.DataType] = {}
+    slot_num: int = 0
+
+    def __init__(self, folder: str, compression: str = "zstd"):
+        """
+        Profiles in long format: one row per profile owner (e.g. a person) and timeslot, with the profiles as
+        compact columns (profile_types). The dataset is partitioned by partition_column (<folder>/<column>=<id>/)
+        and each owner is one row group, so that reading some owners or profiles only decodes those.
+        The rows of an owner are its slot_num timeslots in order. The owners are identified by keys:
+        (partition value, values of key_types).
+        """
+        self.folder = folder
+        self.compression = compression
+        self.schema = pa.schema(list(self.key_types.items()) + list(self.profile_types.items()))
+
+    @staticmethod
+    @abstractmethod
+    def get_mark(key: tuple) -> str:
+        ...
+
+    @classmethod
+    def exists(cls, folder: str) -> bool:
+        return os.path.isdir(folder) and any(name.startswith(f"{cls.partition_column}=") for name in os.listdir(folder))
+
+    def clear(self):
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+
+    def get_partition_folder(self, partition: int) -> str:
+        return os.path.join(self.folder, f"{self.partition_column}={partition}")
+
+    def get_partitions(self) -> List[int]:
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(int(name.split("=")[1]) for name in os.listdir(self.folder)
+                      if name.startswith(f"{self.partition_column}="))
+
+    def write(self, profiles: Dict[tuple, Dict[str, np.ndarray]]):
+        """
+        Writes the owners to a new file in each partition, so that profiles can be written chunk by chunk.
+        :param profiles: profiles of each key, {profile name: values of the timeslots}
+        """
+        for partition in sorted({key[0] for key in profiles.keys()}):
+            os.makedirs(self.get_partition_folder(partition), exist_ok=True)
+            path = os.path.join(self.get_partition_folder(partition), f"part-{uuid.uuid4().hex}.parquet")
+            with pq.ParquetWriter(path, self.schema, compression=self.compression) as writer:
+                for key, key_profiles in profiles.items():
+                    if key[0] != partition:
+                        continue
+                    columns = {name: np.full(self.slot_num, value) for name, value in zip(self.key_types, key[1:])}
+                    columns.update(key_profiles)
+                    writer.write_table(pa.table(
+                        [pa.array(np.asarray(columns[field.name]), type=field.type) for field in self.schema],
+                        schema=self.schema
+                    ))
+
+    def read_partition(
+        self,
+        partition: int,
+        profile_names: Optional[List[str]] = None,
+        keys: Optional[Iterable[tuple]] = None
+    ) -> Tuple[List[tuple], Dict[str, np.ndarray]]:
+        """
+        :param profile_names: profiles to read, all if None
+        :param keys: values of the key_types columns of the owners to read, all if None
+        :return: keys of the owners and the values of each profile (owners x slot_num)
+        """
+        profile_names = profile_names if profile_names is not None else list(self.profile_types.keys())
+        key_columns = list(self.key_types.keys())
+        dataset = ds.dataset(self.get_partition_folder(partition), format="parquet")
+        row_filter = None
+        if keys is not None:
+            keys = set(keys)
+            for position, column in enumerate(key_columns):
+                column_filter = ds.field(column).isin(sorted({key[position] for key in keys}))
+                row_filter = column_filter if row_filter is None else row_filter & column_filter
+        table = dataset.to_table(columns=key_columns + profile_names, filter=row_filter)
+        key_values = [table.column(column).to_numpy()[::self.slot_num] for column in key_columns]
+        owner_keys = [(partition, *(int(value) for value in values)) for values in zip(*key_values)]
+        selected = np.array([keys is None or key[1:] in keys for key in owner_keys], dtype=bool)
+        values = {name: table.column(name).to_numpy().reshape(-1, self.slot_num)[selected] for name in profile_names}
+        return [key for key, is_selected in zip(owner_keys, selected) if is_selected], values
+
+    def read(
+        self,
+        keys: Optional[Iterable[tuple]] = None,
+        profile_names: Optional[List[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        :param keys: owners to read, all if None
+        :param profile_names: profiles to read, all if None
+        :return: profiles by "{profile name}_{mark}", e.g. "activity_p1t1s1"
+        """
+        if keys is None:
+            partitions = {partition: None for partition in self.get_partitions()}
+        else:
+            partitions = {}
+            for key in keys:
+                partitions.setdefault(key[0], set()).add(key[1:])
+        profiles = {}
+        for partition, partition_keys in partitions.items():
+            owner_keys, values = self.read_partition(partition, profile_names, partition_keys)
+            for name, name_values in values.items():
+                profiles.update({f"{name}_{self.get_mark(key)}": row for key, row in zip(owner_keys, name_values)})
+        return profiles
+
+
+class PersonProfileStore(ProfileStore):
+    """profiles of the persons (id_person_type, id_teleworking_type, sample) at 10-minute resolution"""
+
+    partition_column = "id_person_type"
+    key_types = PERSON_KEY_TYPES
+    profile_types = PERSON_PROFILE_TYPES
+    slot_num = YEAR_TIMESLOT_NUM
+
+    @staticmethod
+    def get_mark(key: tuple) -> str:
+        return get_person_mark(key)
+
+
+class HouseholdProfileStore(ProfileStore):
+    """hourly profiles of the households (id_household_type, sample)"""
+
+    partition_column = "id_household_type"
+    key_types = HOUSEHOLD_KEY_TYPES
+    profile_types = HOUSEHOLD_PROFILE_TYPES
+    slot_num = HOUR_NUM
+
+    @staticmethod
+    def get_mark(key: tuple) -> str:
+        return get_household_mark(key)
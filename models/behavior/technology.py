@@ -0,0 +1,110 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+HOT_WATER_TECHNOLOGY = 23
+
+
+def build_alias_tables(weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the tables of Vose's alias method for each row of weights, so that an outcome is drawn in O(1)
+    with two random numbers, whatever the number of outcomes.
+    :param weights: (unnormalized) probabilities (rows, outcomes), rows without weights draw outcome 0
+    :return: acceptance probability and alias of each (row, outcome)
+    """
+    row_num, outcome_num = weights.shape
+    prob = np.ones((row_num, outcome_num))
+    alias = np.tile(np.arange(outcome_num), (row_num, 1))
+    for row in range(row_num):
+        total = weights[row].sum()
+        if total <= 0:
+            continue
+        scaled = weights[row] * outcome_num / total
+        small = [outcome for outcome in range(outcome_num) if scaled[outcome] < 1]
+        large = [outcome for outcome in range(outcome_num) if scaled[outcome] >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[row, less] = scaled[less]
+            alias[row, less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # the rest have a probability of 1 up to rounding errors
+        for outcome in small + large:
+            prob[row, outcome] = 1
+    return prob, alias
+
+
+def sample_alias(prob: np.ndarray, alias: np.ndarray, rows: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """draws one outcome for each of the rows"""
+    outcome = rng.integers(0, prob.shape[1], size=len(rows))
+    return np.where(rng.random(len(rows)) < prob[rows, outcome], outcome, alias[rows, outcome])
+
+
+def spread(values: np.ndarray, durations: np.ndarray) -> np.ndarray:
+    """adds each value to its timeslot and the following ones, durations[i] timeslots in total"""
+    result = np.zeros(len(values))
+    # the values of earlier timeslots are added first, as in a loop over the timeslots
+    for offset in range(int(durations.max(initial=0)) - 1, -1, -1):
+        slots = np.flatnonzero(durations > offset)
+        result[slots + offset] += values[slots]
+    return result
+
+
+class TechnologyTables:
+
+    def __init__(self, trigger_prob: pd.DataFrame, power: pd.DataFrame, duration: pd.DataFrame):
+        """
+        Technology parameters as arrays indexed by ID (id_activity and id_technology), so that the technologies
+        of a whole activity profile and their demand are looked up in one pass:
+        - power and duration: value of each technology, NaN for unknown IDs
+        - the technologies triggered by an activity are drawn from alias tables (rows: id_activity)
+        """
+        self.power = self.to_id_array(power["id_technology"], power["value"])
+        self.duration = self.to_id_array(duration["id_technology"], duration["value"])
+        self.technologies = np.sort(trigger_prob["id_technology"].unique())
+        activity_ids = trigger_prob["id_activity"].to_numpy()
+        weights = np.zeros((activity_ids.max() + 1, len(self.technologies)))
+        # as the dicts built from the table rows, the last row of an (activity, technology) pair counts
+        weights[activity_ids, np.searchsorted(self.technologies, trigger_prob["id_technology"])] = \
+            trigger_prob["value"].to_numpy(dtype=float)
+        self.has_trigger = weights.sum(axis=1) > 0
+        self.trigger_prob, self.trigger_alias = build_alias_tables(weights)
+
+    @staticmethod
+    def to_id_array(ids: pd.Series, values: pd.Series) -> np.ndarray:
+        array = np.full(ids.max() + 1, np.nan)
+        array[ids.to_numpy()] = values.to_numpy(dtype=float)
+        return array
+
+    def sample_technologies(self, activities: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        :param activities: id_activity of each timeslot
+        :return: id_technology triggered in each timeslot
+        """
+        activities = np.asarray(activities, dtype=np.int64)
+        if activities.max() >= len(self.has_trigger) or not self.has_trigger[activities].all():
+            raise ValueError(f"activities without technology trigger probabilities: "
+                             f"{np.setdiff1d(activities, np.flatnonzero(self.has_trigger))}")
+        return self.technologies[sample_alias(self.trigger_prob, self.trigger_alias, activities, rng)]
+
+    def get_demand(self, technologies: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Each technology runs for its duration from the timeslot where it is triggered, until the end of the
+        profile at the latest. A technology triggered again while it runs adds no power. Technologies
+        shorter than one timeslot run for one timeslot with the power reduced by their duration.
+        :param technologies: id_technology triggered in each timeslot
+        :return: appliance electricity and hot water demand of each timeslot
+        """
+        slot_num = len(technologies)
+        power = self.power[technologies]
+        duration = np.minimum(self.duration[technologies], slot_num - np.arange(slot_num))
+        repeated = (duration > 1) & (technologies == np.r_[-1, technologies[:-1]])
+        short = duration < 1
+        power = np.where(repeated, 0, np.where(short, power * duration, power))
+        # durations of more than one timeslot are truncated to whole timeslots
+        slot_duration = np.where(short, 1, duration).astype(np.int64)
+        is_hot_water = technologies == HOT_WATER_TECHNOLOGY
+        appliance_electricity = spread(np.where(is_hot_water, 0, power), slot_duration)
+        hot_water = spread(np.where(is_hot_water, power, 0), slot_duration)
+        return appliance_electricity, hot_water
@@ -0,0 +1,124 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from models.operation.constants import OperationResultVar
+from utils.tables import OutputTables
+from utils.tables import PERIOD_RESULT_TABLE_PREFIXES
+
+HOUR_NUM = 8760
+HOURS_PER_MONTH = [744, 672, 744, 720, 744, 720, 744, 744, 720, 744, 720, 744]
+DEFAULT_TOU_BINS = {
+    "OffPeak": list(range(1, 8)) + [23, 24],
+    "Peak": list(range(8, 23)),
+}
+# the mean is the sum divided by the number of hours of the period
+AGGREGATION_UFUNCS = {"sum": np.add, "mean": np.add, "max": np.maximum, "min": np.minimum}
+
+
+def get_year_variables() -> List[str]:
+    return [name for name, var_type in OperationResultVar.__dict__.items()
+            if not name.startswith("_") and var_type == "hour&year"]
+
+
+class PeriodAggregation:
+
+    def __init__(
+        self,
+        name: str,
+        period_index: np.ndarray,
+        labels: Optional[Sequence] = None,
+        functions: Sequence[str] = ("sum",),
+        variables: Optional[List[str]] = None
+    ):
+        """
+        Aggregates the hourly results of a scenario to periods. The hours are sorted by period once, so that
+        each function is applied to all variables (variables x 8760 matrix) in one vectorized call.
+        :param name: name of the period column and suffix of the result table, e.g. "Day" --> OperationResult_RefDay
+        :param period_index: period of each hour of the year, the periods need not be contiguous (e.g. TOU bins)
+        :param labels: value of the period column for each period (in sorted order), period + 1 if None
+        :param functions: "sum", "mean", "max" and/or "min". The result columns are named by the variable
+                for "sum" and "{variable}_{function}" for the other functions.
+        :param variables: variables to aggregate, the "hour&year" variables of OperationResultVar if None
+        """
+        period_index = np.asarray(period_index)
+        assert len(period_index) == HOUR_NUM, f"period index of {name} has {len(period_index)} hours"
+        for function in functions:
+            assert function in AGGREGATION_UFUNCS, f"unknown aggregation function: {function}"
+        self.name = name
+        self.functions = list(functions)
+        self.variables = variables if variables is not None else get_year_variables()
+        self.order = np.argsort(period_index, kind="stable")
+        sorted_index = period_index[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sorted_index[1:] != sorted_index[:-1]])
+        self.hour_nums = np.diff(np.r_[self.starts, HOUR_NUM])
+        self.labels = np.asarray(labels) if labels is not None else sorted_index[self.starts] + 1
+        assert len(self.labels) == len(self.starts), f"{name} has {len(self.starts)} periods but {len(self.labels)} labels"
+
+    def aggregate(self, hour_result: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        :param hour_result: hourly values of (at least) the aggregated variables
+        :return: aggregated values of each result column, one value per period
+        """
+        values = np.vstack([hour_result[variable] for variable in self.variables]).astype(float)[:, self.order]
+        result = {}
+        for function in self.functions:
+            aggregated = AGGREGATION_UFUNCS[function].reduceat(values, self.starts, axis=1)
+            if function == "mean":
+                aggregated = aggregated / self.hour_nums
+            suffix = "" if function == "sum" else f"_{function}"
+            result.update({f"{variable}{suffix}": row for variable, row in zip(self.variables, aggregated)})
+        return result
+
+
+def validate_aggregations(aggregations: Optional[List["PeriodAggregation"]]):
+    """
+    The name of an aggregation is the suffix of its result tables and the name of its period column, so it must be
+    an identifier, unique, and must not name a built-in result table (e.g. "Month" --> OperationResult_RefMonth).
+    """
+    names = [aggregation.name for aggregation in aggregations] if aggregations is not None else []
+    reserved = [name for name in names if any(f"{prefix}{name}" in OutputTables.__members__
+                                              for prefix in PERIOD_RESULT_TABLE_PREFIXES)]
+    if reserved:
+        raise ValueError(f"aggregation names of built-in result tables: {reserved}")
+    invalid = [name for name in names if not name.isidentifier() or name == "ID_Scenario"]
+    if invalid:
+        raise ValueError(f"aggregation names that are no valid table suffix and column name: {invalid}")
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"aggregation names used more than once: {duplicates}")
+
+
+def month_aggregation(functions: Sequence[str] = ("sum",), variables: Optional[List[str]] = None):
+    return PeriodAggregation("Month", np.repeat(np.arange(12), HOURS_PER_MONTH), functions=functions,
+                             variables=variables)
+
+
+def day_aggregation(functions: Sequence[str] = ("sum",), variables: Optional[List[str]] = None):
+    return PeriodAggregation("Day", np.repeat(np.arange(365), 24), functions=functions, variables=variables)
+
+
+def week_aggregation(functions: Sequence[str] = ("sum",), variables: Optional[List[str]] = None):
+    """the 53rd week is the last day of the year"""
+    return PeriodAggregation("Week", np.arange(HOUR_NUM) // 168, functions=functions, variables=variables)
+
+
+def tou_aggregation(
+    bins: Optional[Dict[str, List[int]]] = None,
+    functions: Sequence[str] = ("sum",),
+    variables: Optional[List[str]] = None,
+    name: str = "TOU"
+):
+    """
+    :param bins: time-of-use bins, each with its hours of the day (1, ..., 24), DEFAULT_TOU_BINS if None
+    """
+    bins = bins if bins is not None else DEFAULT_TOU_BINS
+    day_hour_bin = np.full(24, -1)
+    for bin_index, day_hours in enumerate(bins.values()):
+        day_hour_bin[np.asarray(day_hours) - 1] = bin_index
+    assert (day_hour_bin >= 0).all(), f"hours of the day without time-of-use bin: {np.flatnonzero(day_hour_bin < 0) + 1}"
+    return PeriodAggregation(name, np.tile(day_hour_bin, 365), labels=list(bins.keys()), functions=functions,
+                             variables=variables)
+
+
+MONTH_AGGREGATION = month_aggregation()
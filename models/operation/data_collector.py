@@ -1,5 +1,7 @@
 import os.path
-from typing import TYPE_CHECKING, Union, Optional, List
+import time
+import weakref
+from typing import TYPE_CHECKING, Union, Optional, List, Dict, Any
 from abc import ABC, abstractmethod
 import pyomo.environ as pyo
 import pandas as pd
@@ -8,16 +10,127 @@ import logging
 
 from matplotlib import pyplot as plt
 
+import pyarrow as pa
+
 from utils.db import create_db_conn
+from models.operation.aggregation import HOUR_NUM
+from models.operation.aggregation import MONTH_AGGREGATION
+from models.operation.aggregation import PeriodAggregation
+from models.operation.aggregation import get_year_variables
 from models.operation.constants import OperationResultVar
 from utils.tables import OutputTables
-from utils.parquet import write_parquet
+from utils.mmap_store import HourArrayStore
+from utils.parquet import ParquetDataset
 
 if TYPE_CHECKING:
     from utils.config import Config
     from models.operation.model_base import OperationModel
 
 
+# result schema: the variables are saved as float32 and the ID columns with fixed integer types,
+# so that the column types do not depend on the values of a scenario
+RESULT_VAR_DTYPE = np.float32
+RESULT_ID_DTYPES = {"ID_Scenario": np.int32, "Hour": np.int16, "DayHour": np.int8, "Month": np.int8}
+HOUR_VARIABLES = [name for name in OperationResultVar.__dict__.keys() if not name.startswith("_")]
+YEAR_VARIABLES = get_year_variables()
+HOUR_INDEX_COLUMNS = {
+    "Hour": np.arange(1, HOUR_NUM + 1, dtype=RESULT_ID_DTYPES["Hour"]),
+    "DayHour": np.tile(np.arange(1, 25, dtype=RESULT_ID_DTYPES["DayHour"]), 365),
+}
+
+
+def get_hour_store_variables(hour_vars: Optional[List[str]] = None) -> List[str]:
+    return [name for name in HOUR_VARIABLES if not hour_vars or name in hour_vars]
+
+
+def get_hour_store_folder(config: "Config", table_name: str) -> str:
+    """the store is in the main output folder also for parallel tasks, which write their rows into the same store"""
+    return os.path.join(config.output, f"{table_name}Store")
+
+
+def create_result_frame(id_columns: Dict[str, Any], var_columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """creates a result frame with the schema types, the ID columns (scalars or arrays) come first"""
+    length = len(next(iter(var_columns.values())))
+    columns = {}
+    for name, values in id_columns.items():
+        dtype = RESULT_ID_DTYPES.get(name)
+        columns[name] = np.full(length, values, dtype=dtype) if np.isscalar(values) else np.asarray(values, dtype)
+    for name, values in var_columns.items():
+        columns[name] = np.asarray(values, dtype=RESULT_VAR_DTYPE)
+    return pd.DataFrame(columns)
+
+
+class OperationResultWriter:
+
+    def __init__(self, config: "Config", flush_scenario_num: int = 100, flush_seconds: float = 60):
+        """
+        Keeps the result outputs of a run open, so that the data collectors of all scenarios share them:
+        - the hour results are appended to the datasets in the folders <output>/<hour result table name>,
+        - the year and month results are buffered and written to the database in batches, after
+          flush_scenario_num scenarios or flush_seconds seconds, whatever comes first. The current part files of
+          the hour datasets are closed in the same step, so that the hour results of the scenarios in the database
+          are complete if the run is killed,
+        - the hour results are written to the memory-mapped hour stores in <output>/<hour result table name>Store,
+          if the stores are opened (see open_hour_store).
+        Closing the writer writes the remaining results, so it should be closed also if the run fails.
+        """
+        self.config = config
+        self.output_folder = OperationDataCollector.set_output_folder(config)
+        self.db = create_db_conn(config)
+        self.flush_scenario_num = flush_scenario_num
+        self.flush_seconds = flush_seconds
+        self.hour_datasets: Dict[str, ParquetDataset] = {}
+        self.hour_stores: Dict[str, HourArrayStore] = {}
+        self.db_results: Dict[str, List[pd.DataFrame]] = {}
+        self.last_flush_time = time.perf_counter()
+
+    def write_hour_result(self, table_name: str, scenario_id: int, table: pa.Table):
+        if table_name not in self.hour_datasets:
+            self.hour_datasets[table_name] = ParquetDataset(os.path.join(self.output_folder, table_name))
+        self.hour_datasets[table_name].write_table(scenario_id, table)
+
+    def open_hour_store(self, table_name: str, variables: List[str], scenario_ids: List[int]):
+        self.hour_stores[table_name] = HourArrayStore.open_or_create(
+            get_hour_store_folder(self.config, table_name), variables, scenario_ids
+        )
+
+    def write_hour_store(self, table_name: str, scenario_id: int, values: np.ndarray, variables: List[str]):
+        if table_name not in self.hour_stores:
+            self.hour_stores[table_name] = HourArrayStore(get_hour_store_folder(self.config, table_name), mode="r+")
+        self.hour_stores[table_name].write(scenario_id, values, variables)
+
+    def write_db_result(self, table_name: str, data_frame: pd.DataFrame):
+        self.db_results.setdefault(table_name, []).append(data_frame)
+        if len(self.db_results[table_name]) >= self.flush_scenario_num or \
+                time.perf_counter() - self.last_flush_time >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        # the hour results are made durable first: a resumed run skips the scenarios that are in the database
+        for dataset in self.hour_datasets.values():
+            dataset.flush()
+        for table_name, data_frames in self.db_results.items():
+            if data_frames:
+                self.db.write_dataframe(table_name=table_name, data_frame=pd.concat(data_frames, ignore_index=True))
+        self.db_results = {}
+        self.last_flush_time = time.perf_counter()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for dataset in self.hour_datasets.values():
+                dataset.close()
+            for store in self.hour_stores.values():
+                store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class OperationDataCollector(ABC):
     def __init__(
         self,
@@ -27,7 +140,10 @@ class OperationDataCollector(ABC):
         save_year: Optional[bool] = True,
         save_month: Optional[bool] = False,
         save_hour: Optional[bool] = False,
-        hour_vars: Optional[List[str]] = None
+        save_hour_store: Optional[bool] = False,
+        hour_vars: Optional[List[str]] = None,
+        result_writer: Optional["OperationResultWriter"] = None,
+        aggregations: Optional[List["PeriodAggregation"]] = None
     ):
         """
         :param model: either the ref model or the opt model
@@ -36,22 +152,33 @@ class OperationDataCollector(ABC):
         :param save_hour: if True hourly results are saved (default = True)
         :param save_month: if True monthly results are saved (default = False)
         :param save_year: if True yearly results are saved (default = True)
+        :param save_hour_store: if True hourly results (the hour_vars) are written to the memory-mapped hour store
         :param hour_vars: if a list of variables is provided only these variables are being saved as hourly
                 results. save_hourly_results has to be True. This is to save disc space if only eg. the Load is needed.
+        :param result_writer: writer shared by the scenarios of a run. If None, the results of this scenario are
+                written by a writer of its own.
+        :param aggregations: additional period aggregations (e.g. day, week, TOU bins) of the hourly results,
+                each saved in the table OperationResult_{Ref|Opt}{aggregation name}.
         """
         self.model = model
         self.scenario_id = scenario_id
         self.config = config
-        self.db = create_db_conn(config)
+        self.db = result_writer.db if result_writer is not None else create_db_conn(config)
+        self.hour_values: Optional[np.ndarray] = None
         self.hour_result = {}
         self.month_result = {}
         self.year_result = {}
+        self.period_results: Dict[str, Dict[str, np.ndarray]] = {}
+        self.aggregations = aggregations if aggregations is not None else []
         self.save_hour = save_hour
+        self.save_hour_store = save_hour_store
         self.save_month = save_month
         self.save_year = save_year
         self.logger = logging.getLogger(f"{config.project_name}")
         self.hour_vars = hour_vars
         self.output_folder = self.set_output_folder(config)
+        self.result_writer = result_writer
+        self.variables = self.get_required_variables()
 
     @staticmethod
     def set_output_folder(config: "Config"):
@@ -61,10 +188,30 @@ class OperationDataCollector(ABC):
             folder = config.output
         return folder
 
+    def get_required_variables(self) -> List[str]:
+        """the variables that are needed for the enabled outputs, in the order of OperationResultVar"""
+        required = set()
+        if self.save_hour:
+            required.update(self.hour_vars if self.hour_vars else HOUR_VARIABLES)
+        if self.save_hour_store:
+            required.update(get_hour_store_variables(self.hour_vars))
+        if self.save_year or self.save_month:
+            required.update(YEAR_VARIABLES)
+        for aggregation in self.aggregations:
+            required.update(aggregation.variables)
+        return [name for name in HOUR_VARIABLES if name in required]
+
     @abstractmethod
     def get_var_values(self, variable_name: str) -> np.array:
         ...
 
+    def get_hour_values(self, variables: List[str]) -> np.ndarray:
+        """:return: variables x hours matrix of the hourly values"""
+        hour_values = np.empty((len(variables), HOUR_NUM))
+        for row, variable_name in enumerate(variables):
+            hour_values[row] = self.get_var_values(variable_name)
+        return hour_values
+
     @abstractmethod
     def get_total_cost(self) -> float:
         ...
@@ -81,38 +228,22 @@ class OperationDataCollector(ABC):
     def get_year_result_table_name(self) -> str:
         ...
 
-    def convert_hour_to_month(self, values):
-        month_results = []
-        hours_per_month = {
-            1: (1, 744),
-            2: (745, 1416),
-            3: (1417, 2160),
-            4: (2161, 2880),
-            5: (2881, 3624),
-            6: (3625, 4344),
-            7: (4345, 5088),
-            8: (5089, 5832),
-            9: (5833, 6552),
-            10: (6553, 7296),
-            11: (7297, 8016),
-            12: (8017, 8760)
-        }
-        for month, hour_range in hours_per_month.items():
-            month_sum = values[hour_range[0] - 1:hour_range[1]].sum()
-            month_results.append(month_sum)
-        return month_results
+    def get_period_result_table_name(self, period_name: str) -> str:
+        return f"{self.result_table_prefix}{period_name}"
 
     def collect_result(self):
-        for variable_name, variable_type in OperationResultVar.__dict__.items():
-            if not variable_name.startswith("_"):
-                var_values = self.get_var_values(variable_name)
-                # check if the load in the reference model has outliers which would indicate a problem:
-                # if variable_name == "Load" and self.get_hour_result_table_name() == OutputTables.OperationResult_RefHour.name:
-                #     self.check_hourly_results_for_outliers(var_values, variable_name)
-                self.hour_result[variable_name] = var_values
-                if variable_type == "hour&year":
-                    self.month_result[variable_name] = self.convert_hour_to_month(var_values)
-                    self.year_result[variable_name] = var_values.sum()
+        # variables x hours matrix, the hour results are views of its rows
+        self.hour_values = self.get_hour_values(self.variables)
+        # check if the load in the reference model has outliers which would indicate a problem:
+        # if "Load" in self.variables and self.get_hour_result_table_name() == OutputTables.OperationResult_RefHour.name:
+        #     self.check_hourly_results_for_outliers(self.hour_values[self.variables.index("Load")], "Load")
+        self.hour_result = dict(zip(self.variables, self.hour_values))
+        if self.save_year:
+            self.year_result = {name: self.hour_result[name].sum() for name in YEAR_VARIABLES}
+        if self.save_month:
+            self.month_result = MONTH_AGGREGATION.aggregate(self.hour_result)
+        for aggregation in self.aggregations:
+            self.period_results[aggregation.name] = aggregation.aggregate(self.hour_result)
 
     def check_hourly_results_for_outliers(self, profile: np.array, var_name: str):
         """
@@ -140,69 +271,114 @@ class OperationDataCollector(ABC):
             plt.savefig(os.path.join(self.config.figure,
                                      f'Outlier_{self.get_hour_result_table_name()}_S{self.scenario_id}.png'))
 
-    def reduce_df_size(self, frame: pd.DataFrame) -> pd.DataFrame:
-        """
-        reduce the size of a pd Dataframe by down casting the integer type (automatically) and float type (to float32).
-        :param frame: df that should be saved
-        :return: DataFrame with reduced size
-        """
-        float_cols = frame.select_dtypes(include='float').columns
-        frame[float_cols] = frame[float_cols].astype('float32')
-        frame = frame.apply(pd.to_numeric, downcast='integer')
-        return frame
-
     def save_hour_result(self):
-        result_hour_df = pd.DataFrame(self.hour_result)
-        result_hour_df.insert(loc=0, column="ID_Scenario", value=self.scenario_id)
-        result_hour_df.insert(loc=1, column="Hour", value=list(range(1, 8761)))
-        result_hour_df.insert(loc=2, column="DayHour", value=np.tile(np.arange(1, 25), 365))
-        if self.hour_vars:
-            result_hour_df = result_hour_df.loc[:, self.hour_vars]
-        df_to_save = self.reduce_df_size(result_hour_df)
-        write_parquet(
-            data_frame=df_to_save,
-            file_name=self.get_hour_result_table_name() + f"_S{self.scenario_id}",
-            folder=self.output_folder
-        )
+        hour_values = self.hour_values.astype(RESULT_VAR_DTYPE)
+        columns = {"ID_Scenario": np.full(HOUR_NUM, self.scenario_id, dtype=RESULT_ID_DTYPES["ID_Scenario"])}
+        columns.update(HOUR_INDEX_COLUMNS)
+        columns.update(zip(self.variables, hour_values))
+        column_names = self.hour_vars if self.hour_vars else list(columns.keys())
+        # the arrow arrays share the memory of the numpy arrays
+        table = pa.Table.from_arrays([pa.array(columns[name]) for name in column_names], names=column_names)
+        if self.result_writer is not None:
+            self.result_writer.write_hour_result(self.get_hour_result_table_name(), self.scenario_id, table)
+        else:
+            with OperationResultWriter(self.config) as result_writer:
+                result_writer.write_hour_result(self.get_hour_result_table_name(), self.scenario_id, table)
+
+    def save_hour_store_result(self):
+        store_variables = get_hour_store_variables(self.hour_vars)
+        if store_variables == self.variables:
+            values = self.hour_values
+        else:
+            values = self.hour_values[[self.variables.index(name) for name in store_variables]]
+        if self.result_writer is not None:
+            self.result_writer.write_hour_store(self.get_hour_result_table_name(), self.scenario_id, values,
+                                                store_variables)
+        else:
+            with OperationResultWriter(self.config) as result_writer:
+                result_writer.write_hour_store(self.get_hour_result_table_name(), self.scenario_id, values,
+                                               store_variables)
 
     def save_month_result(self):
-        result_month_df = pd.DataFrame(self.month_result)
-        result_month_df.insert(loc=0, column="ID_Scenario", value=self.scenario_id)
-        result_month_df.insert(loc=1, column="Month", value=list(range(1, 13)))
-        df_to_save = self.reduce_df_size(result_month_df)
-        self.db.write_dataframe(
-            table_name=self.get_month_result_table_name(),
-            data_frame=df_to_save
+        result_month_df = create_result_frame(
+            id_columns={"ID_Scenario": self.scenario_id, "Month": MONTH_AGGREGATION.labels},
+            var_columns=self.month_result
         )
+        self.write_db_result(table_name=self.get_month_result_table_name(), data_frame=result_month_df)
 
     def save_year_result(self):
-        result_year_df = pd.DataFrame(self.year_result, index=[0])
-        result_year_df.insert(loc=0, column="ID_Scenario", value=self.scenario_id)
-        result_year_df.insert(loc=1, column="TotalCost", value=self.get_total_cost())
-        df_to_save = self.reduce_df_size(result_year_df)
-
-        self.db.write_dataframe(
-            table_name=self.get_year_result_table_name(),
-            data_frame=df_to_save
-        )
+        var_columns = {"TotalCost": [self.get_total_cost()]}
+        var_columns.update({name: [value] for name, value in self.year_result.items()})
+        result_year_df = create_result_frame(id_columns={"ID_Scenario": self.scenario_id}, var_columns=var_columns)
+        self.write_db_result(table_name=self.get_year_result_table_name(), data_frame=result_year_df)
+
+    def save_period_results(self):
+        for aggregation in self.aggregations:
+            period_result_df = create_result_frame(
+                id_columns={"ID_Scenario": self.scenario_id, aggregation.name: aggregation.labels},
+                var_columns=self.period_results[aggregation.name]
+            )
+            self.write_db_result(table_name=self.get_period_result_table_name(aggregation.name),
+                                 data_frame=period_result_df)
+
+    def write_db_result(self, table_name: str, data_frame: pd.DataFrame):
+        if self.result_writer is not None:
+            self.result_writer.write_db_result(table_name, data_frame)
+        else:
+            self.db.write_dataframe(table_name=table_name, data_frame=data_frame)
 
     def run(self):
         self.collect_result()
+        self.save_result()
+
+    def save_result(self):
         if self.save_hour:
             self.save_hour_result()
+        if self.save_hour_store:
+            self.save_hour_store_result()
         if self.save_month:
             self.save_month_result()
         if self.save_year:
             self.save_year_result()
+        self.save_period_results()
+
+
+# the opt instance is reused for all scenarios, so its component data lists are built once per instance
+_INSTANCE_COMPONENT_DATA = weakref.WeakKeyDictionary()
 
 
 class OptDataCollector(OperationDataCollector):
+    result_table_prefix = "OperationResult_Opt"
+
     def get_var_values(self, variable_name: str) -> np.array:
         var_values = np.array(
             list(self.model.__dict__[variable_name].extract_values().values())
         )
         return var_values
 
+    def get_component_data(self, variables: List[str]) -> list:
+        """
+        :return: the data objects (var data or mutable param data) of the variables, concatenated in the order of
+                the variables and, within each variable, in the order of its index set. So, the values of each
+                variable are a contiguous slice of HOUR_NUM values.
+        """
+        instance_cache = _INSTANCE_COMPONENT_DATA.setdefault(self.model, {})
+        key = tuple(variables)
+        if key not in instance_cache:
+            component_data = []
+            for variable_name in variables:
+                component = self.model.__dict__[variable_name]
+                assert len(component) == HOUR_NUM, f"{variable_name} has {len(component)} values"
+                component_data.extend(component.values())
+            instance_cache[key] = component_data
+        return instance_cache[key]
+
+    def get_hour_values(self, variables: List[str]) -> np.ndarray:
+        # one pass over the loaded solution instead of a dict and a list per variable, values that were not
+        # set by the solver (None) become nan
+        values = np.array([data.value for data in self.get_component_data(variables)], dtype=float)
+        return values.reshape(len(variables), HOUR_NUM)
+
     def get_total_cost(self) -> float:
         total_cost = self.model.total_operation_cost_rule()
         return total_cost
@@ -218,8 +394,11 @@ class OptDataCollector(OperationDataCollector):
 
 
 class RefDataCollector(OperationDataCollector):
+    result_table_prefix = "OperationResult_Ref"
+
     def get_var_values(self, variable_name: str) -> np.array:
-        var_values = np.array(self.model.__dict__[variable_name])
+        # the ref model holds the results as arrays already, which are read without copying
+        var_values = np.asarray(self.model.__dict__[variable_name])
         return var_values
 
     def get_total_cost(self) -> float:
@@ -1,6 +1,8 @@
+import gc
 import math
 import os
 import shutil
+import time
 from typing import List
 from typing import Optional
 
@@ -10,17 +12,36 @@ from joblib import Parallel
 from joblib import delayed
 from tqdm import tqdm
 
+from models.operation.aggregation import PeriodAggregation
+from models.operation.aggregation import validate_aggregations
+from models.operation.data_collector import OperationResultWriter
 from models.operation.data_collector import OptDataCollector
+from models.operation.data_collector import get_hour_store_folder
+from models.operation.data_collector import get_hour_store_variables
 from models.operation.data_collector import RefDataCollector
 from models.operation.model_opt import OptInstance
 from models.operation.model_opt import OptOperationModel
+from models.operation.model_opt import SolvePolicy
+from models.operation.model_opt import SolverSettings
 from models.operation.model_ref import RefOperationModel
 from models.operation.scenario import OperationScenario
+from models.operation.scenario import get_scenario_input_columns
 from utils.config import Config
+from utils.db import copy_db_file
 from utils.db import create_db_conn
+from utils.db import dispose_engines
 from utils.db import fetch_input_tables
+from utils.func import get_logger
+from utils.mmap_store import HourArrayStore
+from utils.parquet import ParquetDataset
+from utils.profiler import ScenarioProfiler
+from utils.profiler import profile_scenario
 from utils.tables import InputTables
+from utils.tables import OPERATION_INPUT_TABLES
 from utils.tables import OutputTables
+from utils.timer import StageTimer
+
+logger = get_logger(__name__)
 
 DB_RESULT_TABLES = [
         OutputTables.OperationResult_RefYear.name,
@@ -30,22 +51,55 @@ DB_RESULT_TABLES = [
     ]
 
 
+def get_db_result_tables(aggregations: Optional[List["PeriodAggregation"]] = None) -> List[str]:
+    result_tables = DB_RESULT_TABLES.copy()
+    for aggregation in aggregations if aggregations is not None else []:
+        result_tables += [f"{RefDataCollector.result_table_prefix}{aggregation.name}",
+                          f"{OptDataCollector.result_table_prefix}{aggregation.name}"]
+    return result_tables
+
+
+def get_hour_table_names(run_ref: bool, run_opt: bool) -> List[str]:
+    table_names = []
+    if run_ref:
+        table_names.append(OutputTables.OperationResult_RefHour.name)
+    if run_opt:
+        table_names.append(OutputTables.OperationResult_OptHour.name)
+    return table_names
+
+
 def run_ref_model(
     scenario: "OperationScenario",
     config: "Config",
     save_year: bool = True,
     save_month: bool = False,
     save_hour: bool = False,
-    hour_vars: Optional[List[str]] = None
+    hour_vars: Optional[List[str]] = None,
+    timer: Optional["StageTimer"] = None,
+    save_hour_store: bool = False,
+    result_writer: Optional["OperationResultWriter"] = None,
+    aggregations: Optional[List["PeriodAggregation"]] = None
 ):
-    ref_model = RefOperationModel(scenario).solve()
-    RefDataCollector(model=ref_model,
-                     scenario_id=scenario.scenario_id,
-                     config=config,
-                     save_year=save_year,
-                     save_month=save_month,
-                     save_hour=save_hour,
-                     hour_vars=hour_vars).run()
+    timer = timer if timer is not None else StageTimer(enabled=False)
+    scenario_id = scenario.scenario_id
+    with timer.stage(scenario_id, "ref_setup"):
+        ref_model = RefOperationModel(scenario)
+    with timer.stage(scenario_id, "ref_solve"):
+        ref_model = ref_model.solve()
+    with timer.stage(scenario_id, "ref_extract"):
+        data_collector = RefDataCollector(model=ref_model,
+                                          scenario_id=scenario_id,
+                                          config=config,
+                                          save_year=save_year,
+                                          save_month=save_month,
+                                          save_hour=save_hour,
+                                          save_hour_store=save_hour_store,
+                                          hour_vars=hour_vars,
+                                          result_writer=result_writer,
+                                          aggregations=aggregations)
+        data_collector.collect_result()
+    with timer.stage(scenario_id, "ref_write"):
+        data_collector.save_result()
 
 
 def run_opt_model(
@@ -55,17 +109,90 @@ def run_opt_model(
     save_year: bool = True,
     save_month: bool = False,
     save_hour: bool = False,
-    hour_vars: Optional[List[str]] = None
-):
-    opt_model, solve_status = OptOperationModel(scenario).solve(opt_instance)
+    hour_vars: Optional[List[str]] = None,
+    timer: Optional["StageTimer"] = None,
+    save_hour_store: bool = False,
+    solver_attempts: Optional[List["SolverSettings"]] = None,
+    solve_records: Optional[List[dict]] = None,
+    solve_pass: str = "regular",
+    result_writer: Optional["OperationResultWriter"] = None,
+    aggregations: Optional[List["PeriodAggregation"]] = None
+) -> bool:
+    """
+    :param solver_attempts: solver settings that are tried one after the other until the model is solved
+    :param solve_records: if provided, the outcome of each attempt is appended to it
+    :param solve_pass: "regular" or "deferred", saved in the solve records
+    :return: True if the opt model was solved
+    """
+    timer = timer if timer is not None else StageTimer(enabled=False)
+    solver_attempts = solver_attempts if solver_attempts is not None else [SolverSettings()]
+    scenario_id = scenario.scenario_id
+    with timer.stage(scenario_id, "opt_setup"):
+        opt_model = OptOperationModel(scenario)
+    with timer.stage(scenario_id, "opt_config"):
+        opt_instance = opt_model.config_instance(opt_instance)
+    with timer.stage(scenario_id, "opt_solve"):
+        for attempt, solver_settings in enumerate(solver_attempts, start=1):
+            t_start = time.perf_counter()
+            opt_instance, solve_status = opt_model.solve_instance(opt_instance, solver_settings)
+            if solve_records is not None:
+                solve_records.append({
+                    "ID_Scenario": scenario_id,
+                    "Pass": solve_pass,
+                    "Attempt": attempt,
+                    "Solver": solver_settings.solver_name,
+                    "TimeLimit": solver_settings.time_limit,
+                    "Threads": solver_settings.threads,
+                    "TerminationCondition": opt_model.termination_condition,
+                    "Seconds": time.perf_counter() - t_start,
+                })
+            if solve_status:
+                break
     if solve_status:
-        OptDataCollector(model=opt_model,
-                         scenario_id=scenario.scenario_id,
-                         config=config,
-                         save_year=save_year,
-                         save_month=save_month,
-                         save_hour=save_hour,
-                         hour_vars=hour_vars).run()
+        with timer.stage(scenario_id, "opt_extract"):
+            data_collector = OptDataCollector(model=opt_instance,
+                                              scenario_id=scenario_id,
+                                              config=config,
+                                              save_year=save_year,
+                                              save_month=save_month,
+                                              save_hour=save_hour,
+                                              save_hour_store=save_hour_store,
+                                              hour_vars=hour_vars,
+                                              result_writer=result_writer,
+                                              aggregations=aggregations)
+            data_collector.collect_result()
+        with timer.stage(scenario_id, "opt_write"):
+            data_collector.save_result()
+    else:
+        logger.warning(f"Opt model not solved after {len(solver_attempts)} attempt(s) --> ID_Scenario = {scenario_id}")
+    return solve_status
+
+
+def save_run_metrics(config: "Config", timer: "StageTimer"):
+    if timer.records:
+        create_db_conn(config).write_dataframe(
+            table_name=OutputTables.OperationResult_RunMetrics.name,
+            data_frame=timer.to_dataframe(),
+            if_exists="replace"
+        )
+    logger.info(f"{config.project_name} run metrics:\n{timer.summary_text()}")
+
+
+def save_solve_status(config: "Config", solve_records: List[dict]):
+    if not solve_records:
+        return
+    solve_status = pd.DataFrame(solve_records)
+    create_db_conn(config).write_dataframe(
+        table_name=OutputTables.OperationResult_SolveStatus.name,
+        data_frame=solve_status,
+        if_exists="replace"
+    )
+    last_attempts = solve_status.groupby("ID_Scenario").tail(1)
+    retried = solve_status.loc[solve_status["Attempt"] > 1, "ID_Scenario"].unique()
+    deferred = solve_status.loc[solve_status["Pass"] == "deferred", "ID_Scenario"].unique()
+    failed = last_attempts.loc[last_attempts["TerminationCondition"] != "optimal", "ID_Scenario"].to_list()
+    logger.info(f"{config.project_name} solve status: {len(retried)} scenario(s) retried, "
+                f"{len(deferred)} deferred, {len(failed)} not solved {failed}")
 
 
 def run_operation_model(config: "Config",
@@ -75,16 +202,38 @@ def run_operation_model(config: "Config",
                         save_year: bool = True,
                         save_month: bool = False,
                         save_hour: bool = False,
-                        hour_vars: List[str] = None):
+                        hour_vars: List[str] = None,
+                        record_metrics: bool = True,
+                        profiler: Optional["ScenarioProfiler"] = None,
+                        solve_policy: Optional["SolvePolicy"] = None,
+                        aggregations: Optional[List["PeriodAggregation"]] = None,
+                        save_hour_store: bool = False):
+    """
+    :param record_metrics: if True, the duration of each stage (scenario setup, model setup, solve, result
+            extraction and writing) is recorded per scenario, saved in the OperationResult_RunMetrics table and
+            summarized (p50/p95 per stage, scenarios/s) at the end of the run.
+    :param profiler: if provided, the scenarios selected by the profiler are profiled and the profiles are written
+            to the profiler's folder, named by scenario ID.
+    :param solve_policy: solver settings (time limit, retries, deferred queue) of the opt model.
+            The outcome of each solve attempt is saved in the OperationResult_SolveStatus table.
+    :param aggregations: additional period aggregations of the hourly results (e.g. day, week, TOU bins, see
+            models.operation.aggregation), computed in the same pass and saved as OperationResult_{Ref|Opt}{name}.
+    :param save_hour_store: if True, the hourly results (hour_vars) are also written to the memory-mapped stores
+            <output>/OperationResult_{Ref|Opt}HourStore, with one scenarios x 8760 array per variable
+            (see utils.mmap_store.HourArrayStore).
+    """
 
     def align_progress(initial_scenario_ids):
 
         def get_latest_scenario_ids():
             latest_scenario_ids = []
             db_tables = db.get_table_names()
-            for result_table in DB_RESULT_TABLES:
+            for result_table in result_tables:
                 if result_table in db_tables:
-                    latest_scenario_ids.append(db.read_dataframe(result_table)["ID_Scenario"].to_list()[-1])
+                    latest_scenario_id = db.query(
+                        f"SELECT ID_Scenario FROM {result_table} ORDER BY rowid DESC LIMIT 1"
+                    )["ID_Scenario"].to_list()
+                    latest_scenario_ids.extend(latest_scenario_id)
             return latest_scenario_ids
 
         def drop_until(lst, target_value):
@@ -97,29 +246,76 @@ def run_operation_model(config: "Config",
         if len(latest_scenario_ids) > 0:
             latest_scenario_id = min(latest_scenario_ids)
             db_tables = db.get_table_names()
-            for result_table in DB_RESULT_TABLES:
+            for result_table in result_tables:
                 if result_table in db_tables:
-                    with db.connection.connect() as conn:
-                        result = conn.execute(sqlalchemy.text(f"DELETE FROM {result_table} WHERE ID_Scenario >= '{latest_scenario_id}'"))
+                    db.create_indexes(result_table)
+                    with db.engine.begin() as conn:
+                        conn.execute(
+                            sqlalchemy.text(f"DELETE FROM {result_table} WHERE ID_Scenario >= :latest_scenario_id"),
+                            {"latest_scenario_id": int(latest_scenario_id)}
+                        )
             updated_scenario_ids = drop_until(initial_scenario_ids, latest_scenario_id)
         else:
             updated_scenario_ids = initial_scenario_ids
         return updated_scenario_ids
 
+    validate_aggregations(aggregations)
     db = create_db_conn(config)
-    input_tables = fetch_input_tables(config)
+    result_tables = get_db_result_tables(aggregations)
+    input_tables = fetch_input_tables(config, table_names=[table.name for table in OPERATION_INPUT_TABLES])
     if scenario_ids is None:
         scenario_ids = input_tables[InputTables.OperationScenario.name]["ID_Scenario"].to_list()
     scenario_ids = align_progress(scenario_ids)
-    opt_instance = OptInstance().create_instance()
-    for scenario_id in tqdm(scenario_ids, desc=f"{config.project_name}"):
-        scenario = OperationScenario(config=config, scenario_id=scenario_id, input_tables=input_tables)
-        if run_ref:
-            run_ref_model(scenario=scenario, config=config, save_year=save_year, save_month=save_month,
-                          save_hour=save_hour, hour_vars=hour_vars)
-        if run_opt:
+    input_tables.set_columns(get_scenario_input_columns(input_tables, scenario_ids))
+    opt_instance = None
+    if run_opt:
+        opt_instance = OptInstance().create_instance()
+    timer = StageTimer(enabled=record_metrics)
+    solve_policy = solve_policy if solve_policy is not None else SolvePolicy()
+    solve_records = []
+    deferred_scenario_ids = []
+    result_writer = OperationResultWriter(config)
+    if save_hour_store:
+        for table_name in get_hour_table_names(run_ref, run_opt):
+            result_writer.open_hour_store(table_name, get_hour_store_variables(hour_vars), scenario_ids)
+    if run_opt:
+        # the instance is reused for all scenarios: moving its (millions of) objects to the permanent generation
+        # keeps the garbage collector from traversing them in every full collection during the run
+        gc.freeze()
+    try:
+        for scenario_id in tqdm(scenario_ids, desc=f"{config.project_name}"):
+            with profile_scenario(profiler, scenario_id):
+                with timer.stage(scenario_id, "scenario_setup"):
+                    scenario = OperationScenario(config=config, scenario_id=scenario_id, input_tables=input_tables)
+                if run_ref:
+                    run_ref_model(scenario=scenario, config=config, save_year=save_year, save_month=save_month,
+                                  save_hour=save_hour, hour_vars=hour_vars, timer=timer, result_writer=result_writer,
+                                  aggregations=aggregations, save_hour_store=save_hour_store)
+                if run_opt:
+                    solved = run_opt_model(opt_instance=opt_instance, scenario=scenario, config=config,
+                                           save_year=save_year, save_month=save_month, save_hour=save_hour,
+                                           hour_vars=hour_vars, timer=timer, solver_attempts=solve_policy.attempts,
+                                           solve_records=solve_records, result_writer=result_writer,
+                                           aggregations=aggregations, save_hour_store=save_hour_store)
+                    if not solved and solve_policy.deferred is not None:
+                        deferred_scenario_ids.append(scenario_id)
+            timer.count_scenario()
+        for scenario_id in tqdm(deferred_scenario_ids, desc=f"{config.project_name} (deferred)"):
+            scenario = OperationScenario(config=config, scenario_id=scenario_id, input_tables=input_tables)
             run_opt_model(opt_instance=opt_instance, scenario=scenario, config=config, save_year=save_year,
-                          save_month=save_month, save_hour=save_hour, hour_vars=hour_vars)
+                          save_month=save_month, save_hour=save_hour, hour_vars=hour_vars, timer=timer,
+                          solver_attempts=[solve_policy.deferred], solve_records=solve_records,
+                          solve_pass="deferred", result_writer=result_writer, aggregations=aggregations,
+                          save_hour_store=save_hour_store)
+    finally:
+        if run_opt:
+            # moves the frozen objects back, so that they are collected once the instance is no longer used
+            gc.unfreeze()
+        result_writer.close()
+        timer.stop()
+        if record_metrics:
+            save_run_metrics(config, timer)
+        save_solve_status(config, solve_records)
 
 
 def run_operation_model_parallel(
@@ -131,14 +327,19 @@ def run_operation_model_parallel(
     save_month: bool = False,
     save_hour: bool = False,
     hour_vars: List[str] = None,
-    reset_task_dbs: bool = True
+    reset_task_dbs: bool = True,
+    record_metrics: bool = True,
+    profiler: Optional["ScenarioProfiler"] = None,
+    solve_policy: Optional["SolvePolicy"] = None,
+    aggregations: Optional[List["PeriodAggregation"]] = None,
+    save_hour_store: bool = False
 ):
 
     def create_task_dbs():
         for task_id in range(1, task_num + 1):
             task_config = config.make_copy().set_task_id(task_id=task_id)
-            shutil.copy(os.path.join(task_config.output, f'{config.project_name}.sqlite'),
-                        os.path.join(task_config.task_output, f'{config.project_name}.sqlite'))
+            copy_db_file(os.path.join(task_config.output, f'{config.project_name}.sqlite'),
+                         os.path.join(task_config.task_output, f'{config.project_name}.sqlite'))
 
     def split_scenarios():
         total_scenario_num = len(create_db_conn(config).read_dataframe(InputTables.OperationScenario.name))
@@ -168,7 +369,12 @@ def run_operation_model_parallel(
                 "save_year": save_year,
                 "save_month": save_month,
                 "save_hour": save_hour,
-                "hour_vars": hour_vars
+                "hour_vars": hour_vars,
+                "record_metrics": record_metrics,
+                "profiler": profiler,
+                "solve_policy": solve_policy,
+                "aggregations": aggregations,
+                "save_hour_store": save_hour_store
             }
             for task_id in range(1, task_num + 1)
         ]
@@ -177,7 +383,9 @@ def run_operation_model_parallel(
     def merge_task_results():
 
         def merge_year_month_tables():
-            for table_name in DB_RESULT_TABLES:
+            # the run tables describe this run only (as in the serial run), the result tables are appended to
+            run_tables = [OutputTables.OperationResult_RunMetrics.name, OutputTables.OperationResult_SolveStatus.name]
+            for table_name in get_db_result_tables(aggregations) + run_tables:
                 table_exists = False
                 task_results = []
                 for task_id in range(1, task_num + 1):
@@ -190,28 +398,44 @@ def run_operation_model_parallel(
                 if table_exists:
                     create_db_conn(config).write_dataframe(
                         table_name=table_name,
-                        data_frame=pd.concat(task_results, ignore_index=True)
+                        data_frame=pd.concat(task_results, ignore_index=True),
+                        if_exists="replace" if table_name in run_tables else "append"
                     )
 
-        def move_hour_parquets():
-            for task_id in range(1, task_num + 1):
-                task_config = config.make_copy().set_task_id(task_id=task_id)
-                for file_name in os.listdir(task_config.task_output):
-                    if file_name.endswith(".parquet.gzip"):
-                        shutil.move(os.path.join(task_config.task_output, file_name),
-                                    os.path.join(task_config.output, file_name))
+        def merge_hour_datasets():
+            for table_name in [OutputTables.OperationResult_RefHour.name, OutputTables.OperationResult_OptHour.name]:
+                dataset = ParquetDataset(os.path.join(config.output, table_name))
+                for task_id in range(1, task_num + 1):
+                    task_folder = os.path.join(config.make_copy().set_task_id(task_id=task_id).task_output, table_name)
+                    if ParquetDataset.exists(task_folder):
+                        dataset.merge(task_folder)
+                if ParquetDataset.exists(dataset.folder):
+                    dataset.compact()
 
         merge_year_month_tables()
-        move_hour_parquets()
+        merge_hour_datasets()
 
     def remove_task_folders():
         for task_id in range(1, task_num + 1):
             task_config = config.make_copy().set_task_id(task_id=task_id)
+            dispose_engines(task_config.task_output)
             shutil.rmtree(task_config.task_output)
 
+    def create_hour_stores():
+        # the rows of all scenarios are assigned before the tasks start, so that they write into the same stores.
+        # Each task marks the scenarios it runs as not written when it opens the stores.
+        scenario_ids = create_db_conn(config).read_dataframe(InputTables.OperationScenario.name)["ID_Scenario"].to_list()
+        for table_name in get_hour_table_names(run_ref, run_opt):
+            HourArrayStore.open_or_create(get_hour_store_folder(config, table_name),
+                                          get_hour_store_variables(hour_vars), scenario_ids,
+                                          reset_written=False).close()
+
+    validate_aggregations(aggregations)
     if reset_task_dbs:
         create_task_dbs()
         split_scenarios()
+    if save_hour_store:
+        create_hour_stores()
     run_tasks()
     merge_task_results()
     remove_task_folders()
@@ -1,3 +1,6 @@
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List
+
 import numpy as np
 import pyomo.environ as pyo
 from pyomo.opt import TerminationCondition
@@ -471,23 +474,80 @@ class OptInstance:
 
 class OptOperationModel(OperationModel):
 
-    # @performance_counter
     def solve(self, instance):
+        instance = self.config_instance(instance)
+        return self.solve_instance(instance)
+
+    def config_instance(self, instance):
+        return OptConfig(self).config_instance(instance)
+
+    def solve_instance(self, instance, solver_settings: Optional["SolverSettings"] = None):
         logger = logging.getLogger(f"{self.scenario.config.project_name}")
         logger.info("starting solving Opt model.")
-        instance = OptConfig(self).config_instance(instance)
-        results = pyo.SolverFactory("gurobi").solve(instance, tee=False)
+        solver_settings = solver_settings if solver_settings is not None else SolverSettings()
+        results = solver_settings.create_solver().solve(instance, tee=False, load_solutions=False)
+        self.termination_condition = str(results.solver.termination_condition)
         if results.solver.termination_condition == TerminationCondition.optimal:
             instance.solutions.load_from(results)
             logger.info(f"OptCost: {round(instance.total_operation_cost_rule(), 2)}")
             solved = True
         else:
-            print(f'Infeasible Scenario Warning!!!!!!!!!!!!!!!!!!!!!! --> ID_Scenario = {self.scenario.scenario_id}')
-            logger.warning(f'Infeasible Scenario Warning!!!!!!!!!!!!!!!!!!!!!! --> ID_Scenario = {self.scenario.scenario_id}')
+            logger.warning(f'Opt model not solved ({self.termination_condition}) --> '
+                           f'ID_Scenario = {self.scenario.scenario_id}')
             solved = False
         return instance, solved
 
 
+SOLVER_OPTION_NAMES = {
+    "gurobi": {"time_limit": "TimeLimit", "threads": "Threads"},
+    "gurobi_direct": {"time_limit": "TimeLimit", "threads": "Threads"},
+    "cplex": {"time_limit": "timelimit", "threads": "threads"},
+    "appsi_highs": {"time_limit": "time_limit", "threads": "threads"},
+    "cbc": {"time_limit": "seconds", "threads": "threads"},
+    "glpk": {"time_limit": "tmlim"},
+}
+
+
+@dataclass
+class SolverSettings:
+    """
+    Settings of one attempt to solve the opt model.
+    time_limit (seconds) and threads are translated to the option names of the solver,
+    further solver specific options (e.g. {"NumericFocus": 2} for gurobi) can be given in options.
+    """
+    solver_name: str = "gurobi"
+    time_limit: Optional[float] = None
+    threads: Optional[int] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    def create_solver(self):
+        solver = pyo.SolverFactory(self.solver_name)
+        if self.time_limit is not None:
+            solver.options[self.get_option_name("time_limit")] = self.time_limit
+        if self.threads is not None:
+            solver.options[self.get_option_name("threads")] = self.threads
+        for key, value in self.options.items():
+            solver.options[key] = value
+        return solver
+
+    def get_option_name(self, option: str) -> str:
+        option_name = SOLVER_OPTION_NAMES.get(self.solver_name, {}).get(option)
+        if option_name is None:
+            raise ValueError(f"{option} is not known for solver {self.solver_name}, please set it in options.")
+        return option_name
+
+
+@dataclass
+class SolvePolicy:
+    """
+    attempts: settings that are tried one after the other until the opt model of a scenario is solved.
+    deferred: if provided, scenarios that are not solved with any of the attempts are put into a deferred queue,
+        which is solved again with these settings (e.g. a longer time limit and more threads) at the end of the run.
+    """
+    attempts: List[SolverSettings] = field(default_factory=lambda: [SolverSettings()])
+    deferred: Optional[SolverSettings] = None
+
+
 class OptConfig:
 
     def __init__(self, model: 'OperationModel'):
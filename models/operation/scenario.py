@@ -1,6 +1,6 @@
 import sys
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 import numpy as np
 import pandas as pd
@@ -153,3 +153,47 @@ class OperationScenario:
             self.behavior.vehicle_at_home = parking_home[str(self.vehicle.id_parking_at_home_profile)].to_numpy()
             self.behavior.vehicle_distance = distance[str(self.vehicle.id_distance_profile)].to_numpy()
             self.behavior.vehicle_demand = self.behavior.vehicle_distance * self.vehicle.consumption_rate
+
+
+def get_scenario_input_columns(
+        input_tables: Dict[str, pd.DataFrame],
+        scenario_ids: Optional[List[int]] = None
+) -> Dict[str, List[str]]:
+    """
+    Returns the columns of the wide input tables (profiles by demand profile type, prices and driving profiles by id,
+    PV generation by orientation) that the given scenarios read in their setup,
+    so that fetch_input_tables only has to load these columns.
+    """
+    scenarios = input_tables[InputTables.OperationScenario.name]
+    if scenario_ids is not None:
+        scenarios = scenarios.loc[scenarios["ID_Scenario"].isin(scenario_ids)]
+
+    def get_component_rows(component_info) -> pd.DataFrame:
+        df = input_tables[component_info.table_name]
+        return df.loc[df[component_info.id_name].isin(scenarios[component_info.id_name])]
+
+    buildings = get_component_rows(OperationScenarioComponent.Building)
+    behavior_columns = [
+        f"{profile}_dpt{id_demand_profile_type}"
+        for id_demand_profile_type in buildings["id_demand_profile_type"].unique()
+        for profile in ["appliance_electricity", "hot_water", "occupancy", "ventilation_supply_temperature"]
+    ]
+    pvs = get_component_rows(OperationScenarioComponent.PV)
+    weather_columns = ["temperature", "radiation_north", "radiation_south", "radiation_east", "radiation_west"] + \
+                      [f"pv_generation_{orientation}" for orientation in pvs["orientation"].unique()]
+    energy_prices = get_component_rows(OperationScenarioComponent.EnergyPrice)
+    energy_price_columns = [
+        f"{column.replace('id_', '')}_{value}"
+        for column in energy_prices.columns if column.startswith("id_")
+        for value in energy_prices[column].dropna().unique()
+    ]
+    vehicles = get_component_rows(OperationScenarioComponent.Vehicle)
+    return {
+        InputTables.OperationScenario_BehaviorProfile.name: behavior_columns,
+        InputTables.OperationScenario_RegionWeather.name: weather_columns,
+        InputTables.OperationScenario_EnergyPrice.name: energy_price_columns,
+        InputTables.OperationScenario_DrivingProfile_ParkingHome.name:
+            [str(value) for value in vehicles["id_parking_at_home_profile"].unique()],
+        InputTables.OperationScenario_DrivingProfile_Distance.name:
+            [str(value) for value in vehicles["id_distance_profile"].unique()],
+    }
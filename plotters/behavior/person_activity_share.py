@@ -1,6 +1,8 @@
 import os.path
 
+from models.behavior.profile_store import PersonProfileStore
 from utils.db import create_db_conn
+from utils.func import get_time_cols_10min
 from utils.config import Config
 from utils.tables import InputTables, OutputTables
 import numpy as np
@@ -68,7 +70,8 @@ def person_activity_share(config: "Config", person_types: List[int], day_types:
     db = create_db_conn(config)
     df_activities = db.read_dataframe(InputTables.BehaviorID_Activity.name)
     df_tus = db.read_dataframe(InputTables.BehaviorParam_Activity_TUSProfile.name)
-    df_sim = db.read_dataframe(OutputTables.BehaviorResult_PersonProfiles.name)
+    store = PersonProfileStore(os.path.join(config.output, OutputTables.BehaviorResult_PersonProfiles.name))
+    day_types_of_year = get_time_cols_10min()["id_day_type"].to_numpy()[::144]
 
     def get_activities():
         activities = {}
@@ -85,20 +88,13 @@ def person_activity_share(config: "Config", person_types: List[int], day_types:
         return df.loc[:, "t1":"t144"].to_numpy()
 
     def get_sim_matrix(id_person_type: Optional[int] = None, id_day_type: Optional[int] = None):
+        person_types = [id_person_type] if id_person_type is not None else store.get_partitions()
+        activities = np.vstack([store.read_partition(person_type, ["activity"])[1]["activity"]
+                                for person_type in person_types])
+        day_matrix = activities.reshape(len(activities), -1, 144)
         if id_person_type is not None and id_day_type is not None:
-            df = df_sim[["hour", "week_day", "id_day_type", "day_hour", "hour_slot"] +
-                        [col for col in df_sim.columns if col.startswith(f"activity_p{id_person_type}")]]
-            df = df.loc[df["id_day_type"] == id_day_type].reset_index(drop=True)
-        else:
-            df = df_sim[["hour", "week_day", "id_day_type", "day_hour", "hour_slot"] +
-                        [col for col in df_sim.columns if col.startswith(f"activity_p")]]
-        day_num, remaining = divmod(len(df), 144)
-        assert remaining == 0
-        df.drop(columns=["hour", "week_day", "id_day_type", "day_hour", "hour_slot"], inplace=True)
-        profile_matrix_list = []
-        for day in range(0, day_num):
-            profile_matrix_list.append(df.iloc[144 * day:144 * (day + 1)].to_numpy().transpose())
-        return np.vstack(profile_matrix_list)
+            day_matrix = day_matrix[:, day_types_of_year == id_day_type]
+        return day_matrix.reshape(-1, 144)
 
     for id_person_type in person_types:
         for id_day_type in day_types:
@@ -1,23 +1,26 @@
+import os
 from typing import List, Optional
 
 import numpy as np
 
 from utils.config import Config
-from utils.parquet import read_parquet
+from utils.parquet import ParquetDataset
 from utils.plotter import Plotter
 
 
 def household_load_balance(config: "Config", scenario_ids: List[int], models: Optional[List[str]] = None):
     _models = ["Opt", "Ref"]
     weeks = {"Winter": (145, 312), "Summer": (4177, 4344)}
+    column_names = ["BaseLoadProfile", "E_Heating_HP_out", "E_DHW_HP_out", "Q_HeatingElement_heat",
+                    "Q_HeatingElement_DHW", "E_RoomCooling", "EVCharge", "BatCharge", "BatDischarge",
+                    "PV2Load", "PV2Bat", "PV2EV", "PV2Grid", "Grid"]
     for id_scenario in scenario_ids:
         if models is not None:
             _models = models
         for model in _models:
-            file_name = f'OperationResult_{model}Hour_S{id_scenario}'
-            df = read_parquet(file_name, config.output)
+            dataset = ParquetDataset(os.path.join(config.output, f'OperationResult_{model}Hour'))
             for season, hour_range in weeks.items():
-                df_week = df[df["Hour"].between(hour_range[0], hour_range[1])]
+                df_week = dataset.read([id_scenario], column_names=column_names, hour_range=hour_range)
                 values_dict = {
                     "Appliance": np.array(df_week["BaseLoadProfile"]) / 1000,
                     "HP_SpaceHeating": np.array(df_week["E_Heating_HP_out"]) / 1000,
@@ -1,6 +1,7 @@
 import os
 from typing import List
 
+import numpy as np
 import pandas as pd
 
 from models.community.main import run_community_model
@@ -10,7 +11,8 @@ from plotters.community import battery_operation
 from utils.config import Config
 from utils.db import DB
 from utils.db import init_project_db
-from utils.parquet import read_parquet
+from utils.mmap_store import HourArrayStore
+from utils.parquet import ParquetDataset
 from utils.tables import InputTables
 from utils.tables import OutputTables
 
@@ -45,21 +47,27 @@ def copy_household_ref_hour(
     operation_output_folder: str = f"../operation/output",
     community_input_folder: str = "input"
 ):
-    operation_ref_hour_profiles: List[pd.DataFrame] = []
-    for id_operation_scenario in operation_scenario_ids:
-        operation_ref_hour_profiles.append(read_parquet(
-            file_name=f'{OutputTables.OperationResult_RefHour.name}_S{id_operation_scenario}',
-            folder=operation_output_folder,
-            column_names=[
-                'ID_Scenario',
-                'PhotovoltaicProfile',
-                'Grid',
-                'Load',
-                'Feed2Grid',
-                'BatSoC'
-            ]
-        ))
-    pd.concat(operation_ref_hour_profiles, ignore_index=True).to_csv(
+    column_names = [
+        'ID_Scenario',
+        'PhotovoltaicProfile',
+        'Grid',
+        'Load',
+        'Feed2Grid',
+        'BatSoC'
+    ]
+    store_folder = os.path.join(operation_output_folder, f'{OutputTables.OperationResult_RefHour.name}Store')
+    if HourArrayStore.exists(store_folder):
+        # the hour store (save_hour_store=True) holds each variable of all scenarios as one array
+        store = HourArrayStore(store_folder)
+        operation_ref_hour_profiles = pd.DataFrame({
+            'ID_Scenario': np.repeat(list(operation_scenario_ids), store.hour_num),
+            **{name: store.read(name, operation_scenario_ids)[1].ravel() for name in column_names[1:]}
+        })
+    else:
+        operation_ref_hour_profiles = ParquetDataset(
+            os.path.join(operation_output_folder, OutputTables.OperationResult_RefHour.name)
+        ).read(scenario_ids=operation_scenario_ids, column_names=column_names)
+    operation_ref_hour_profiles.to_csv(
         os.path.join(community_input_folder, f'{InputTables.CommunityScenario_Household_RefHour.name}.csv'),
         index=False
     )
@@ -1,21 +1,85 @@
 import os
-from typing import TYPE_CHECKING, List, Dict
+import shutil
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
 
 import pandas as pd
 import sqlalchemy
 
+from utils.input_cache import INPUT_CACHE_FOLDER
+from utils.input_cache import InputFileCache
+from utils.input_cache import find_input_file
+from utils.input_cache import get_file_key
+from utils.input_cache import read_input_file
 from utils.tables import InputTables
+from utils.tables import get_index_columns
 
 if TYPE_CHECKING:
     from utils.config import Config
 
 
+# applied to each new connection: with WAL, readers do not block the writer and commits need fewer syncs
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # in KiB
+    "temp_store": "MEMORY",
+}
+# {input table: key of the file it was loaded from}, see init_project_db
+INPUT_SOURCE_TABLE = "InputSource"
+_ENGINES: Dict[str, Tuple[int, sqlalchemy.Engine]] = {}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def get_engine(path: str) -> sqlalchemy.Engine:
+    """returns the engine of the database file, which is created once per process and reused with its connections"""
+    path = os.path.abspath(path)
+    pid, engine = _ENGINES.get(path, (None, None))
+    if engine is None or pid != os.getpid():
+        engine = sqlalchemy.create_engine(f'sqlite:///{path}')
+        sqlalchemy.event.listen(engine, "connect", _set_sqlite_pragmas)
+        _ENGINES[path] = (os.getpid(), engine)
+    return engine
+
+
+def dispose_engine(path: str):
+    """closes the connections to the database file, e.g. before the file is copied, moved or deleted"""
+    pid, engine = _ENGINES.pop(os.path.abspath(path), (None, None))
+    if engine is not None and pid == os.getpid():
+        engine.dispose()
+
+
+def dispose_engines(folder: str):
+    """closes the connections to all database files in the folder (and its subfolders)"""
+    folder = os.path.join(os.path.abspath(folder), "")
+    for path in [path for path in _ENGINES.keys() if path.startswith(folder)]:
+        dispose_engine(path)
+
+
+def copy_db_file(source_path: str, target_path: str):
+    """copies a database file including the changes that are still in its WAL, replacing the target database"""
+    DB(source_path).checkpoint()
+    dispose_engine(target_path)
+    for suffix in ["-wal", "-shm"]:
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    shutil.copy(source_path, target_path)
+
+
 class DB:
 
     def __init__(self, path):
-        self.engine = sqlalchemy.create_engine(f'sqlite:///{path}')
+        self.path = os.path.abspath(path)
+        self.engine = get_engine(self.path)
+        # tables are reflected when they are first read
         self.metadata = sqlalchemy.MetaData()
-        self.metadata.reflect(bind=self.engine)
+        # tables whose indexes were created by this connection, see create_indexes
+        self.indexed_tables = set()
 
     def if_exists(self, table_name: str) -> bool:
         return table_name in self.get_table_names()
@@ -24,19 +88,59 @@ class DB:
         return self.engine
 
     def close(self):
-        self.engine.dispose()
+        dispose_engine(self.path)
+
+    def checkpoint(self):
+        """writes the WAL into the database file, so that the file can be copied on its own"""
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+    def get_table(self, table_name: str) -> sqlalchemy.Table:
+        if table_name not in self.metadata.tables:
+            sqlalchemy.Table(table_name, self.metadata, autoload_with=self.engine)
+        return self.metadata.tables[table_name]
+
+    def forget_table(self, table_name: str):
+        if table_name in self.metadata.tables:
+            self.metadata.remove(self.metadata.tables[table_name])
+        self.indexed_tables.discard(table_name)
+
+    def create_indexes(self, table_name: str, column_names: Optional[List[str]] = None):
+        """
+        Creates the indexes of the key columns of a known table (see utils.tables.get_index_columns) if they
+        do not exist yet. SQLite keeps them up to date when rows are added or deleted.
+        :param column_names: columns of the table, read from the database if None
+        """
+        if table_name in self.indexed_tables:
+            return
+        if column_names is None:
+            column_names = self.get_column_names(table_name)
+        index_columns = get_index_columns(table_name, column_names)
+        if index_columns:
+            with self.engine.begin() as conn:
+                for column in index_columns:
+                    conn.execute(sqlalchemy.text(
+                        f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{column}" ON "{table_name}" ("{column}")'
+                    ))
+        self.indexed_tables.add(table_name)
 
     def get_table_names(self):
         return sqlalchemy.inspect(self.engine).get_table_names()
 
+    def get_column_names(self, table_name: str) -> List[str]:
+        return [column["name"] for column in sqlalchemy.inspect(self.engine).get_columns(table_name)]
+
     def clear_database(self):
         for table_name in self.get_table_names():
-            with self.engine.connect() as conn:
+            with self.engine.begin() as conn:
                 result = conn.execute(sqlalchemy.text(f"drop table {table_name}"))
+        self.metadata.clear()
+        self.indexed_tables.clear()
 
     def drop_table(self, table_name: str):
-        with self.engine.connect() as conn:
+        with self.engine.begin() as conn:
             result = conn.execute(sqlalchemy.text(f"drop table if exists {table_name}"))
+        self.forget_table(table_name)
 
     def write_dataframe(
             self,
@@ -45,6 +149,9 @@ class DB:
             data_types: dict = None,
             if_exists="append",
     ):  # if_exists: {'replace', 'fail', 'append'}
+        if if_exists == "replace":
+            self.forget_table(table_name)
+        self.invalidate_input_source(table_name)
         data_frame.to_sql(
             table_name,
             self.engine,
@@ -53,6 +160,21 @@ class DB:
             if_exists=if_exists,
             chunksize=10_000,
         )
+        self.create_indexes(table_name, [str(column) for column in data_frame.columns])
+
+    def invalidate_input_source(self, table_name: str):
+        """
+        An input table that is written after init_project_db loaded it no longer matches its input file,
+        so its entry in the InputSource table is removed and init_project_db loads the file again.
+        """
+        if table_name in InputTables.__members__ and self.if_exists(INPUT_SOURCE_TABLE):
+            with self.engine.begin() as conn:
+                conn.execute(sqlalchemy.text(f'DELETE FROM "{INPUT_SOURCE_TABLE}" WHERE "Table" = :table_name'),
+                             {"table_name": table_name})
+
+    def count_rows(self, table_name: str) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(sqlalchemy.text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar()
 
     def read_dataframe(self, table_name: str, filter: dict = None, column_names: List[str] = None) -> pd.DataFrame:
         """Reads data from a database table with optional filtering and column selection.
@@ -65,10 +187,10 @@ class DB:
                 Returns:
                     pd.DataFrame: Resulting dataframe.
                 """
-        table = self.metadata.tables[table_name]
+        table = self.get_table(table_name)
 
         if column_names:
-            query = sqlalchemy.select([table.columns[name] for name in column_names])
+            query = sqlalchemy.select(*[table.columns[name] for name in column_names])
         else:
             query = sqlalchemy.select(table)
 
@@ -90,7 +212,9 @@ class DB:
         condition = condition[0:-5]  # deleting last "and"
 
         query = f"DELETE FROM {table_name}" + condition
-        self.engine.execute(query)
+        self.invalidate_input_source(table_name)
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.text(query))
 
     def query(self, sql) -> pd.DataFrame:
         return pd.read_sql(sql, self.engine)
@@ -104,35 +228,102 @@ def create_db_conn(config: "Config") -> DB:
     return conn
 
 
-def init_project_db(config: "Config"):
+def init_project_db(config: "Config", use_cache: bool = True):
+    """
+    Loads the input files of the project into its database and drops all other tables.
+    :param use_cache: if True, input tables whose file did not change since the last run (and that were not
+            written since, see DB.invalidate_input_source, and have the same number of rows) are kept in the database,
+            and changed files are read from the converted-input cache (see InputFileCache) or parsed in parallel.
+            If False, all input files are parsed and loaded again.
+    """
     db = create_db_conn(config)
-    db.clear_database()
-
-    def file_exists(table_name: str):
-        df = None
-        extensions = {".xlsx": pd.read_excel,
-                      ".csv": pd.read_csv}
-        for ext, pd_read_func in extensions.items():
-            file_path = os.path.join(config.input, table_name + ext)
-            if os.path.exists(file_path):
-                df = pd_read_func(file_path)
-                break
+    file_paths = {}
+    for input_table in InputTables:
+        file_path = find_input_file(config.input, input_table.name)
+        if file_path is not None:
+            file_paths[input_table.name] = file_path
+    file_keys = {table_name: get_file_key(file_path) for table_name, file_path in file_paths.items()}
+
+    loaded = {}
+    if use_cache and db.if_exists(INPUT_SOURCE_TABLE):
+        input_source = db.read_dataframe(INPUT_SOURCE_TABLE)
+        if "RowNum" in input_source.columns:
+            loaded = {table_name: (file_key, row_num) for table_name, file_key, row_num in
+                      zip(input_source["Table"], input_source["FileKey"], input_source["RowNum"])}
+    table_names = db.get_table_names()
+    unchanged = [table_name for table_name in file_keys.keys()
+                 if table_name in table_names and table_name in loaded and
+                 loaded[table_name][0] == file_keys[table_name] and loaded[table_name][1] == db.count_rows(table_name)]
+    for table_name in table_names:
+        if table_name in unchanged:
+            db.create_indexes(table_name)
+        else:
+            db.drop_table(table_name)
+
+    changed_paths = {table_name: file_path for table_name, file_path in file_paths.items()
+                     if table_name not in unchanged}
+    if use_cache:
+        tables = InputFileCache(os.path.join(config.output, INPUT_CACHE_FOLDER)).load(changed_paths)
+    else:
+        tables = {table_name: read_input_file(file_path) for table_name, file_path in changed_paths.items()}
+    for table_name, df in tables.items():
+        print(f'Loading input table --> {table_name}')
+        db.write_dataframe(table_name=table_name, data_frame=df, if_exists="replace")
+    db.write_dataframe(
+        table_name=INPUT_SOURCE_TABLE,
+        data_frame=pd.DataFrame({
+            "Table": list(file_keys.keys()),
+            "FileKey": list(file_keys.values()),
+            "RowNum": [db.count_rows(table_name) for table_name in file_keys.keys()],
+        }),
+        if_exists="replace"
+    )
+
+
+class InputTableLoader(dict):
+
+    def __init__(self, config: "Config", table_names: List[str], columns: Optional[Dict[str, List[str]]] = None):
+        """
+        Dict of input tables, in which each table is read from the project database when it is first accessed.
+        :param table_names: the tables that can be loaded, other names raise a KeyError
+        :param columns: {table_name: column_names} to only read these columns of wide tables
+        """
+        super().__init__()
+        self.config = config
+        self.table_names = set(table_names)
+        self.columns: Dict[str, List[str]] = {}
+        if columns is not None:
+            self.set_columns(columns)
+
+    def set_columns(self, columns: Dict[str, List[str]]):
+        for table_name, column_names in columns.items():
+            self.columns[table_name] = column_names
+            self.pop(table_name, None)
+
+    def __missing__(self, table_name: str) -> pd.DataFrame:
+        if table_name not in self.table_names:
+            raise KeyError(table_name)
+        db = create_db_conn(self.config)
+        column_names = self.columns.get(table_name)
+        if column_names is not None:
+            table_columns = db.get_column_names(table_name)
+            column_names = [name for name in table_columns if name in set(column_names)]
+        df = db.read_dataframe(table_name, column_names=column_names)
+        self[table_name] = df
         return df
 
-    for input_table in InputTables:
-        df = file_exists(input_table.name)
-        if df is not None:
-            print(f'Loading input table --> {input_table.name}')
-            db.write_dataframe(
-                table_name=input_table.name,
-                data_frame=df.dropna(axis=1, how="all").dropna(axis=0, how="all"),
-                if_exists="replace"
-            )
-
-
-def fetch_input_tables(config: "Config") -> Dict[str, pd.DataFrame]:
-    input_tables = {}
-    db = create_db_conn(config)
-    for table_name in db.get_table_names():
-        input_tables[table_name] = db.read_dataframe(table_name)
-    return input_tables
+
+def fetch_input_tables(
+        config: "Config",
+        table_names: Optional[List[str]] = None,
+        columns: Optional[Dict[str, List[str]]] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Returns the input tables of the project, which are loaded lazily when they are first accessed.
+    Result tables in the database are never loaded.
+    :param table_names: names of the tables that can be accessed, all InputTables by default
+    :param columns: {table_name: column_names} to only load some columns of wide tables
+    """
+    if table_names is None:
+        table_names = [input_table.name for input_table in InputTables]
+    return InputTableLoader(config, table_names, columns)
@@ -1,4 +1,5 @@
-from typing import List, Union, Dict, Any
+import os
+from typing import List, Union, Dict, Any, Optional
 import random
 from pathlib import Path
 import logging
@@ -14,27 +15,31 @@ def get_logger(name, level=logging.DEBUG, file_name: Union[str, "Path"] = None):
     logger.setLevel(level)
     formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
     if file_name:
-        file_handler = logging.FileHandler(file_name)
-        file_handler.setLevel(level)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        file_path = os.path.abspath(file_name)
+        if not any(getattr(handler, "baseFilename", None) == file_path for handler in logger.handlers):
+            file_handler = logging.FileHandler(file_name)
+            file_handler.setLevel(level)
+            file_handler.setFormatter(formatter)
+            logger.addHandler(file_handler)
     else:
-        stream_handler = logging.StreamHandler()
-        stream_handler.setLevel(logging.INFO)
-        stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        if not any(type(handler) is logging.StreamHandler for handler in logger.handlers):
+            stream_handler = logging.StreamHandler()
+            stream_handler.setLevel(logging.INFO)
+            stream_handler.setFormatter(formatter)
+            logger.addHandler(stream_handler)
 
     return logger
 
 
 def performance_counter(func):
+    logger = get_logger(__name__)
+
     @wraps(func)
-    def wrapper(*args):
+    def wrapper(*args, **kwargs):
         t_start = time.perf_counter()
-        result = func(*args)
+        result = func(*args, **kwargs)
         t_end = time.perf_counter()
         exe_time = round(t_end - t_start, 3)
-        logger = get_logger(__name__)
         logger.info(f"Timer: {func.__name__} - {exe_time}s.")
         return result
 
@@ -79,13 +84,17 @@ def filter_df2s(df: pd.DataFrame, filter_dict: dict) -> pd.Series:
     return s
 
 
-def dict_sample(options: Dict[Any, float]) -> Any:
+def dict_sample(options: Dict[Any, float], rand: Optional[float] = None) -> Any:
+    """
+    :param rand: uniform random number in [0, 1] that selects the option, drawn from the random module if None
+    """
     value_sum = 0
     for key in options.keys():
         value_sum += options[key]
     for key in options.keys():
         options[key] = options[key] / value_sum
-    rand = random.uniform(0, 1)
+    if rand is None:
+        rand = random.uniform(0, 1)
     prob_accumulated = 0
     option_chosen_key = None
     for key in options.keys():
@@ -0,0 +1,93 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+from joblib import Parallel
+from joblib import delayed
+
+from utils.func import get_logger
+
+logger = get_logger(__name__)
+
+INPUT_CACHE_FOLDER = "input_cache"
+INPUT_FILE_READERS = {
+    ".xlsx": pd.read_excel,
+    ".csv": pd.read_csv,
+}
+
+
+def find_input_file(folder: str, table_name: str) -> Optional[str]:
+    for ext in INPUT_FILE_READERS.keys():
+        file_path = os.path.join(folder, table_name + ext)
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+
+def get_file_key(file_path: str) -> str:
+    """identifies the version of an input file by its name, size and modification time"""
+    stat = os.stat(file_path)
+    return f"{os.path.basename(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def read_input_file(file_path: str) -> pd.DataFrame:
+    df = INPUT_FILE_READERS[os.path.splitext(file_path)[1]](file_path)
+    return df.dropna(axis=1, how="all").dropna(axis=0, how="all")
+
+
+class InputFileCache:
+
+    manifest_file_name = "_manifest.json"
+
+    def __init__(self, folder: str, n_jobs: int = -1):
+        """
+        Keeps the converted input tables as parquet files in `folder`, each with the key of the source file
+        it was converted from. Tables whose source file did not change are read from the cache, the others are
+        parsed (in parallel if there are several) and written to the cache.
+        :param n_jobs: number of processes that parse changed files (joblib convention, -1: all cpus)
+        """
+        self.folder = folder
+        self.n_jobs = n_jobs
+        self.manifest_path = os.path.join(folder, self.manifest_file_name)
+        self.manifest: Dict[str, str] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def get_cache_path(self, table_name: str) -> str:
+        return os.path.join(self.folder, f"{table_name}.parquet")
+
+    def is_cached(self, table_name: str, file_key: str) -> bool:
+        return self.manifest.get(table_name) == file_key and os.path.exists(self.get_cache_path(table_name))
+
+    def load(self, file_paths: Dict[str, str]) -> Dict[str, pd.DataFrame]:
+        """
+        :param file_paths: {table_name: path of the source file}
+        :return: {table_name: converted table}
+        """
+        file_keys = {table_name: get_file_key(file_path) for table_name, file_path in file_paths.items()}
+        changed: List[str] = [table_name for table_name, file_key in file_keys.items()
+                              if not self.is_cached(table_name, file_key)]
+        tables = {table_name: pd.read_parquet(self.get_cache_path(table_name))
+                  for table_name in file_paths.keys() if table_name not in changed}
+        n_jobs = min(self.n_jobs if self.n_jobs > 0 else os.cpu_count() or 1, len(changed))
+        if n_jobs > 1:
+            parsed = Parallel(n_jobs=n_jobs)(delayed(read_input_file)(file_paths[table_name]) for table_name in changed)
+        else:
+            parsed = [read_input_file(file_paths[table_name]) for table_name in changed]
+        if changed:
+            os.makedirs(self.folder, exist_ok=True)
+        for table_name, df in zip(changed, parsed):
+            tables[table_name] = df
+            try:
+                df.to_parquet(self.get_cache_path(table_name), index=False)
+                self.manifest[table_name] = file_keys[table_name]
+            except (ValueError, TypeError, ImportError) as e:
+                # e.g. columns with mixed types, the table is parsed again next time
+                logger.warning(f"Input table {table_name} is not cached: {e}")
+                self.manifest.pop(table_name, None)
+        if changed:
+            with open(self.manifest_path, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+        return {table_name: tables[table_name] for table_name in file_paths.keys()}
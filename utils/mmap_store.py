@@ -0,0 +1,172 @@
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class HourArrayStore:
+
+    meta_file_name = "_store.json"
+    id_file_name = "_ids.npy"
+    written_file_name = "_written.npy"
+
+    def __init__(self, folder: str, mode: str = "r"):
+        """
+        Variable-major store of hourly results: each variable is a memory-mapped array <variable>.npy of shape
+        scenarios x hours with a fixed row per scenario (the ID map _ids.npy), so that reading one variable for
+        all scenarios is a slice of the mapped file. The rows are assigned when the store is created, so
+        parallel tasks can write their scenarios into the same store.
+        :param folder: folder of an existing store, see HourArrayStore.create
+        :param mode: "r" to read, "r+" to write
+        """
+        self.folder = folder
+        self.mode = mode
+        with open(os.path.join(folder, self.meta_file_name)) as f:
+            meta = json.load(f)
+        self.variables: List[str] = meta["variables"]
+        self.hour_num: int = meta["hour_num"]
+        self._arrays: Dict[str, np.memmap] = {}
+        self._load_rows()
+
+    def _load_rows(self):
+        self.scenario_ids = np.load(os.path.join(self.folder, self.id_file_name))
+        self.rows: Dict[int, int] = {scenario_id: row for row, scenario_id in enumerate(self.scenario_ids.tolist())}
+        self.written = np.load(os.path.join(self.folder, self.written_file_name), mmap_mode=self.mode)
+
+    @classmethod
+    def create(
+        cls,
+        folder: str,
+        variables: List[str],
+        scenario_ids: Iterable[int],
+        hour_num: int = 8760,
+        dtype: str = "float32"
+    ) -> "HourArrayStore":
+        """creates the (sparse) files of an empty store with a row for each scenario"""
+        scenario_ids = np.asarray(list(scenario_ids), dtype=np.int64)
+        os.makedirs(folder, exist_ok=True)
+        for variable in variables:
+            np.lib.format.open_memmap(os.path.join(folder, f"{variable}.npy"), mode="w+", dtype=dtype,
+                                      shape=(len(scenario_ids), hour_num)).flush()
+        np.save(os.path.join(folder, cls.id_file_name), scenario_ids)
+        np.save(os.path.join(folder, cls.written_file_name), np.zeros(len(scenario_ids), dtype=bool))
+        with open(os.path.join(folder, cls.meta_file_name), "w") as f:
+            json.dump({"variables": variables, "hour_num": hour_num, "dtype": dtype}, f)
+        return cls(folder, mode="r+")
+
+    @classmethod
+    def open_or_create(
+        cls,
+        folder: str,
+        variables: List[str],
+        scenario_ids: Iterable[int],
+        hour_num: int = 8760,
+        reset_written: bool = True
+    ) -> "HourArrayStore":
+        """
+        Opens the store for writing if it has the variables, adding rows for the scenarios that it does not have
+        yet, so that the rows written by earlier runs are kept. A store with other variables is created again.
+        :param reset_written: if True, the scenarios are marked as not written, so that a scenario that is not
+                solved in this run is not read with the values of an earlier run
+        """
+        scenario_ids = list(scenario_ids)
+        store = None
+        if cls.exists(folder):
+            store = cls(folder, mode="r+")
+            if store.variables == variables and store.hour_num == hour_num:
+                store.extend(scenario_ids)
+            else:
+                store.close()
+                store = None
+        if store is None:
+            return cls.create(folder, variables, scenario_ids, hour_num)
+        if reset_written and scenario_ids:
+            store.written[[store.rows[scenario_id] for scenario_id in scenario_ids]] = False
+            store.written.flush()
+        return store
+
+    def extend(self, scenario_ids: Iterable[int], chunk_row_num: int = 1000):
+        """
+        Adds rows for the scenarios that the store does not have yet. The files are rewritten with the new shape,
+        so the store must not be written by other processes meanwhile.
+        """
+        new_ids = [scenario_id for scenario_id in dict.fromkeys(scenario_ids) if scenario_id not in self.rows]
+        if not new_ids:
+            return
+        self.flush()
+        self._arrays = {}
+        row_num = len(self.scenario_ids)
+        new_row_num = row_num + len(new_ids)
+        for variable in self.variables:
+            path = os.path.join(self.folder, f"{variable}.npy")
+            old_array = np.load(path, mmap_mode="r")
+            new_array = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=old_array.dtype,
+                                                  shape=(new_row_num, self.hour_num))
+            for start in range(0, row_num, chunk_row_num):
+                end = min(start + chunk_row_num, row_num)
+                new_array[start:end] = old_array[start:end]
+            new_array.flush()
+            del old_array, new_array
+            os.replace(path + ".tmp", path)
+        # the ID map is written last: until then, the additional rows of the arrays are not used
+        written = np.concatenate([np.asarray(self.written), np.zeros(len(new_ids), dtype=bool)])
+        scenario_ids = np.concatenate([self.scenario_ids, np.asarray(new_ids, dtype=np.int64)])
+        self.written = None
+        for file_name, array in [(self.written_file_name, written), (self.id_file_name, scenario_ids)]:
+            with open(os.path.join(self.folder, file_name + ".tmp"), "wb") as f:
+                np.save(f, array)
+            os.replace(os.path.join(self.folder, file_name + ".tmp"), os.path.join(self.folder, file_name))
+        self._load_rows()
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, HourArrayStore.meta_file_name))
+
+    def get_array(self, variable: str) -> np.memmap:
+        if variable not in self._arrays:
+            self._arrays[variable] = np.load(os.path.join(self.folder, f"{variable}.npy"), mmap_mode=self.mode)
+        return self._arrays[variable]
+
+    def write(self, scenario_id: int, values: np.ndarray, variables: Optional[List[str]] = None):
+        """
+        :param values: variables x hours array of the scenario
+        :param variables: variables of the rows of values, the variables of the store if None
+        """
+        row = self.rows[scenario_id]
+        for variable, variable_values in zip(variables if variables is not None else self.variables, values):
+            self.get_array(variable)[row] = variable_values
+        self.written[row] = True
+
+    def read(self, variable: str, scenario_ids: Optional[Iterable[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the scenario IDs and their values of the variable (scenarios x hours). Without scenario_ids,
+                the values of all written scenarios are returned, as a view of the mapped file if all are written.
+        """
+        array = self.get_array(variable)
+        if scenario_ids is None:
+            if self.written.all():
+                return self.scenario_ids, array
+            rows = np.flatnonzero(self.written)
+        else:
+            rows = np.array([self.rows[scenario_id] for scenario_id in scenario_ids], dtype=np.int64)
+            if not self.written[rows].all():
+                raise KeyError(f"scenarios not written to {self.folder}: {self.scenario_ids[rows[~self.written[rows]]]}")
+        return self.scenario_ids[rows], array[rows]
+
+    def flush(self):
+        for array in self._arrays.values():
+            array.flush()
+        if self.mode != "r":
+            self.written.flush()
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+        self._arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,7 +1,13 @@
+import math
 import os
-from typing import List
+import shutil
+import uuid
+from typing import List, Optional, Iterable, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 def if_parquet_exists(file_name: str, folder: str) -> bool:
@@ -20,3 +26,285 @@ def read_parquet(file_name: str, folder: str, column_names: List[str] = None) ->
     else:
         df = pd.read_parquet(path=path_to_file, engine="auto")
     return df
+
+
+class ParquetDataset:
+
+    index_file_name = "_index.parquet"
+
+    def __init__(
+        self,
+        folder: str,
+        scenarios_per_file: int = 500,
+        row_group_size: int = 730,
+        compression: str = "zstd",
+        compression_level: Optional[int] = None,
+        hour_column: str = "Hour"
+    ):
+        """
+        Hourly results of many scenarios stored in one folder. Each part file holds up to scenarios_per_file
+        scenarios, each split into row groups of row_group_size rows, and the index file maps each scenario to
+        its file and row groups, so that single scenarios are read without opening the other files.
+        Hour ranges are read by skipping the row groups whose hour statistics are outside the range.
+        A scenario that is written again (e.g. after a run was restarted) replaces the former entry in the index.
+        :param folder: folder of the dataset, created if it does not exist
+        :param scenarios_per_file: number of scenarios after which the writer starts a new part file
+        :param row_group_size: rows per row group, i.e. the granularity of reading hour ranges
+        :param hour_column: column that hour ranges refer to
+        """
+        self.folder = folder
+        self.scenarios_per_file = scenarios_per_file
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.hour_column = hour_column
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._file_name: Optional[str] = None
+        self._file_row_groups = 0
+        self._file_scenarios = 0
+        self._new_index_rows: List[dict] = []
+        self._checked_files = False
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.folder, self.index_file_name)
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, ParquetDataset.index_file_name))
+
+    def read_index(self) -> pd.DataFrame:
+        if not os.path.exists(self.index_path):
+            return pd.DataFrame({"ID_Scenario": pd.Series(dtype="int64"), "File": pd.Series(dtype="str"),
+                                 "RowGroup": pd.Series(dtype="int32"), "RowGroupNum": pd.Series(dtype="int32"),
+                                 "RowNum": pd.Series(dtype="int64")})
+        index = pd.read_parquet(self.index_path)
+        # the latest entry of a scenario is the valid one
+        return index.drop_duplicates(subset="ID_Scenario", keep="last").reset_index(drop=True)
+
+    def _write_index(self, index: pd.DataFrame):
+        index.to_parquet(self.index_path + ".tmp", index=False)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _flush_index(self):
+        if self._new_index_rows:
+            index_parts = [pd.read_parquet(self.index_path)] if os.path.exists(self.index_path) else []
+            index_parts.append(pd.DataFrame(self._new_index_rows))
+            self._write_index(pd.concat(index_parts, ignore_index=True))
+            self._new_index_rows = []
+
+    @staticmethod
+    def is_complete_file(path: str) -> bool:
+        """a part file is complete if it ends with the parquet footer, which is written when the file is closed"""
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < 12:
+                    return False
+                f.seek(-4, os.SEEK_END)
+                return f.read(4) == b"PAR1"
+        except OSError:
+            return False
+
+    def remove_incomplete_files(self):
+        """removes the part files that were not closed (e.g. when a run was killed), which can not be read"""
+        if not os.path.exists(self.folder):
+            return
+        indexed_files = set(self.read_index()["File"])
+        for file_name in os.listdir(self.folder):
+            if file_name.startswith("part-") and file_name not in indexed_files and file_name != self._file_name and \
+                    not self.is_complete_file(os.path.join(self.folder, file_name)):
+                os.remove(os.path.join(self.folder, file_name))
+
+    def _open_file(self, schema: pa.Schema):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        if not self._checked_files:
+            self.remove_incomplete_files()
+            self._checked_files = True
+        self._file_name = f"part-{uuid.uuid4().hex}.parquet"
+        self._writer = pq.ParquetWriter(os.path.join(self.folder, self._file_name), schema,
+                                        compression=self.compression, compression_level=self.compression_level)
+        self._file_row_groups = 0
+        self._file_scenarios = 0
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._flush_index()
+
+    def write(self, scenario_id: int, data_frame: pd.DataFrame):
+        """appends the results of one scenario, all scenarios of a file must have the same columns"""
+        self.write_table(scenario_id, pa.Table.from_pandas(data_frame, preserve_index=False))
+
+    def write_table(self, scenario_id: int, table: pa.Table):
+        if self._writer is not None and self._file_scenarios >= self.scenarios_per_file:
+            self._close_file()
+        if self._writer is None:
+            self._open_file(table.schema)
+        elif not table.schema.equals(self._writer.schema, check_metadata=False):
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        row_group_num = max(math.ceil(len(table) / self.row_group_size), 1)
+        self._new_index_rows.append({"ID_Scenario": scenario_id, "File": self._file_name,
+                                     "RowGroup": self._file_row_groups, "RowGroupNum": row_group_num,
+                                     "RowNum": len(table)})
+        self._file_row_groups += row_group_num
+        self._file_scenarios += 1
+
+    def flush(self):
+        """
+        Closes the current part file and writes the index, so that the scenarios written so far are readable and
+        survive if the process is killed. The next scenario starts a new part file.
+        """
+        self._close_file()
+
+    def close(self):
+        self._close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_scenario_ids(self) -> List[int]:
+        return self.read_index()["ID_Scenario"].to_list()
+
+    def select_index(self, scenario_ids: Optional[Iterable[int]] = None) -> pd.DataFrame:
+        """:return: the index rows of the scenarios in the order of scenario_ids (all scenarios if None)"""
+        index = self.read_index()
+        if scenario_ids is None:
+            return index
+        scenario_ids = list(scenario_ids)
+        index = index.set_index("ID_Scenario")
+        missing_ids = [scenario_id for scenario_id in scenario_ids if scenario_id not in index.index]
+        if missing_ids:
+            raise KeyError(f"scenarios not in the dataset {self.folder}: {missing_ids}")
+        return index.loc[scenario_ids].reset_index()
+
+    def _get_hour_statistics(self, parquet_file: pq.ParquetFile) -> Tuple[np.ndarray, np.ndarray]:
+        """:return: minimal and maximal hour of each row group of the file"""
+        column_index = parquet_file.schema_arrow.get_field_index(self.hour_column)
+        if column_index < 0:
+            raise ValueError(f"hour ranges can not be read from {self.folder}: no column {self.hour_column}")
+        metadata = parquet_file.metadata
+        statistics = [metadata.row_group(i).column(column_index).statistics for i in range(metadata.num_row_groups)]
+        return np.array([s.min for s in statistics]), np.array([s.max for s in statistics])
+
+    def read_table(
+        self,
+        scenario_ids: Optional[Iterable[int]] = None,
+        column_names: Optional[List[str]] = None,
+        hour_range: Optional[Tuple[int, int]] = None
+    ) -> pa.Table:
+        """
+        :param scenario_ids: scenarios to read (in this order), all scenarios if None
+        :param column_names: columns to read, all columns if None
+        :param hour_range: first and last hour to read (both included), all hours if None
+        """
+        index = self.select_index(scenario_ids)
+        index["Position"] = np.arange(len(index))
+        tables = []
+        positions = []
+        for file_name, file_index in index.groupby("File", sort=False):
+            parquet_file = pq.ParquetFile(os.path.join(self.folder, file_name))
+            # row groups of the scenarios in the order of the scenarios
+            row_group_nums = file_index["RowGroupNum"].to_numpy()
+            row_groups = np.repeat(file_index["RowGroup"].to_numpy() - np.cumsum(row_group_nums) + row_group_nums,
+                                   row_group_nums) + np.arange(row_group_nums.sum())
+            row_group_positions = np.repeat(file_index["Position"].to_numpy(), row_group_nums)
+            read_column_names = column_names
+            if hour_range is not None:
+                hour_min, hour_max = self._get_hour_statistics(parquet_file)
+                keep = (hour_max[row_groups] >= hour_range[0]) & (hour_min[row_groups] <= hour_range[1])
+                row_groups, row_group_positions = row_groups[keep], row_group_positions[keep]
+                if column_names is not None and self.hour_column not in column_names:
+                    read_column_names = column_names + [self.hour_column]
+            table = parquet_file.read_row_groups(row_groups.tolist(), columns=read_column_names)
+            row_positions = np.repeat(row_group_positions, [parquet_file.metadata.row_group(row_group).num_rows
+                                                            for row_group in row_groups])
+            if hour_range is not None:
+                hours = table.column(self.hour_column).to_numpy()
+                mask = (hours >= hour_range[0]) & (hours <= hour_range[1])
+                table = table.filter(pa.array(mask))
+                row_positions = row_positions[mask]
+                if read_column_names is not column_names:
+                    table = table.drop([self.hour_column])
+            tables.append(table)
+            positions.append(row_positions)
+        if not tables:
+            return pa.table({name: [] for name in column_names}) if column_names else pa.table({})
+        table = pa.concat_tables(tables, promote_options="default")
+        if len(tables) > 1:
+            # the files are read one after the other, the rows are brought back to the order of the scenarios
+            table = table.take(pa.array(np.argsort(np.concatenate(positions), kind="stable")))
+        return table
+
+    def read(
+        self,
+        scenario_ids: Optional[Iterable[int]] = None,
+        column_names: Optional[List[str]] = None,
+        hour_range: Optional[Tuple[int, int]] = None
+    ) -> pd.DataFrame:
+        """:return: tidy frame with the rows of the scenarios (in the order of scenario_ids) one after the other"""
+        return self.read_table(scenario_ids, column_names, hour_range).to_pandas()
+
+    def read_array(
+        self,
+        column_name: str,
+        scenario_ids: Optional[Iterable[int]] = None,
+        hour_range: Optional[Tuple[int, int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the scenario IDs and the values of the column as scenarios x hours array
+        """
+        scenario_ids = np.asarray(self.select_index(scenario_ids)["ID_Scenario"] if scenario_ids is None
+                                  else list(scenario_ids))
+        values = self.read_table(scenario_ids, [column_name], hour_range).column(column_name).to_numpy()
+        return scenario_ids, values.reshape(len(scenario_ids), -1)
+
+    def merge(self, source_folder: str):
+        """moves the part files of the dataset in source_folder (e.g. of a parallel task) into this dataset"""
+        source = ParquetDataset(source_folder)
+        source_index = source.read_index()
+        if len(source_index) == 0:
+            return
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        for file_name in source_index["File"].unique():
+            shutil.move(os.path.join(source_folder, file_name), os.path.join(self.folder, file_name))
+        self._new_index_rows.extend(source_index.to_dict(orient="records"))
+        self._flush_index()
+
+    def compact(self):
+        """
+        Rewrites the part files that are not full (e.g. the last file of each parallel task) into full files
+        ordered by scenario ID, and removes the files and row groups that are no longer in the index.
+        The new files are written before the old ones are removed, so an interrupted compaction loses no results.
+        """
+        self.close()
+        self.remove_incomplete_files()
+        index = self.read_index()
+        scenario_nums = index.groupby("File")["ID_Scenario"].count()
+        small_files = list(scenario_nums.index[scenario_nums < self.scenarios_per_file])
+        stale_files = set(file_name for file_name in os.listdir(self.folder) if file_name.startswith("part-")) - \
+            set(scenario_nums.index)
+        if len(small_files) > 1:
+            parquet_files = {file_name: pq.ParquetFile(os.path.join(self.folder, file_name))
+                             for file_name in small_files}
+            compact_index = index.loc[index["File"].isin(small_files)].sort_values("ID_Scenario")
+            for scenario_id, file_name, row_group, row_group_num in zip(
+                compact_index["ID_Scenario"], compact_index["File"], compact_index["RowGroup"],
+                compact_index["RowGroupNum"]
+            ):
+                table = parquet_files[file_name].read_row_groups(list(range(row_group, row_group + row_group_num)))
+                self.write_table(scenario_id, table)
+            self.close()
+            stale_files.update(small_files)
+        if stale_files:
+            index = self.read_index()
+            self._write_index(index.loc[~index["File"].isin(stale_files)])
+            for file_name in stale_files:
+                os.remove(os.path.join(self.folder, file_name))
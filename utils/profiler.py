@@ -0,0 +1,157 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextlib import nullcontext
+from typing import Optional, Iterable, Union
+
+_NULL_PROFILE = nullcontext()
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Samples the call stack of the profiled thread every `interval` seconds from a background thread.
+        Compared with cProfile, the profiled code runs at (almost) full speed, but short functions can be missed.
+        """
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._sampler.join()
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def write_folded(self, path: str):
+        """writes the stacks in the "folded" format that flame graph tools read"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(";".join(f"{name} ({os.path.basename(file)}:{line})" for file, line, name in stack))
+                f.write(f" {count}\n")
+
+    def top_functions(self, top_n: int) -> str:
+        total = sum(self.stacks.values())
+        own_samples = Counter()
+        cum_samples = Counter()
+        for stack, count in self.stacks.items():
+            own_samples[stack[-1]] += count
+            for function in set(stack):
+                cum_samples[function] += count
+        lines = [f"{total} samples, interval {self.interval}s", "",
+                 f"{'own%':>7} {'cum%':>7}  function"]
+        for function, count in own_samples.most_common(top_n):
+            file, line, name = function
+            lines.append(f"{100 * count / total:7.2f} {100 * cum_samples[function] / total:7.2f}  "
+                         f"{name} ({file}:{line})")
+        return "\n".join(lines)
+
+
+class ScenarioProfiler:
+
+    def __init__(
+        self,
+        folder: str,
+        every_nth: Optional[int] = None,
+        scenario_ids: Optional[Iterable[Union[int, str]]] = None,
+        mode: str = "deterministic",
+        sampling_interval: float = 0.005,
+        top_n: int = 30,
+        file_prefix: str = "profile"
+    ):
+        """
+        Profiles selected scenarios and writes one profile per scenario to `folder`:
+        - "deterministic" mode: {file_prefix}_S{id}.prof (cProfile stats, e.g. for pstats or snakeviz)
+        - "sampling" mode: {file_prefix}_S{id}.folded (stacks for flame graphs)
+        together with {file_prefix}_S{id}.txt listing the top_n functions.
+        :param every_nth: profile every nth scenario (counting the calls of `profile`)
+        :param scenario_ids: profile these scenarios
+        :param mode: "deterministic" (cProfile) or "sampling"
+        """
+        assert mode in ["deterministic", "sampling"], f"unknown profiling mode: {mode}"
+        self.folder = folder
+        self.every_nth = every_nth
+        self.scenario_ids = set(scenario_ids) if scenario_ids is not None else set()
+        self.mode = mode
+        self.sampling_interval = sampling_interval
+        self.top_n = top_n
+        self.file_prefix = file_prefix
+        self.call_num = 0
+
+    def is_selected(self, scenario_id: Union[int, str]) -> bool:
+        self.call_num += 1
+        if scenario_id in self.scenario_ids:
+            return True
+        return self.every_nth is not None and self.call_num % self.every_nth == 0
+
+    def profile(self, scenario_id: Union[int, str]):
+        if not self.is_selected(scenario_id):
+            return _NULL_PROFILE
+        return self._profile(scenario_id)
+
+    def get_file_path(self, scenario_id: Union[int, str], extension: str) -> str:
+        return os.path.join(self.folder, f"{self.file_prefix}_S{scenario_id}.{extension}")
+
+    @contextmanager
+    def _profile(self, scenario_id: Union[int, str]):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        t_start = time.perf_counter()
+        if self.mode == "deterministic":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(self.get_file_path(scenario_id, "prof"))
+                self.write_summary(scenario_id, time.perf_counter() - t_start, self.summarize_stats(profiler))
+        else:
+            profiler = SamplingProfiler(interval=self.sampling_interval)
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                profiler.write_folded(self.get_file_path(scenario_id, "folded"))
+                self.write_summary(scenario_id, time.perf_counter() - t_start, profiler.top_functions(self.top_n))
+
+    def summarize_stats(self, profiler: "cProfile.Profile") -> str:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(self.top_n)
+        return stream.getvalue()
+
+    def write_summary(self, scenario_id: Union[int, str], seconds: float, summary: str):
+        with open(self.get_file_path(scenario_id, "txt"), "w") as f:
+            f.write(f"Scenario {scenario_id}: {round(seconds, 3)}s ({self.mode} profiling)\n\n")
+            f.write(summary)
+
+
+def profile_scenario(profiler: Optional["ScenarioProfiler"], scenario_id: Union[int, str]):
+    """returns the profiling context of the scenario, or a shared no-op context if profiling is disabled"""
+    if profiler is None:
+        return _NULL_PROFILE
+    return profiler.profile(scenario_id)
@@ -1,4 +1,5 @@
 from enum import Enum, auto
+from typing import List
 
 
 class InputTables(Enum):
@@ -50,6 +51,29 @@ class InputTables(Enum):
     CommunityScenario_Component_Battery = auto()
 
 
+# input tables read by FLEX-Operation
+OPERATION_INPUT_TABLES = [
+    InputTables.OperationScenario,
+    InputTables.OperationScenario_Component_Battery,
+    InputTables.OperationScenario_Component_Behavior,
+    InputTables.OperationScenario_Component_Boiler,
+    InputTables.OperationScenario_Component_Building,
+    InputTables.OperationScenario_Component_EnergyPrice,
+    InputTables.OperationScenario_Component_HeatingElement,
+    InputTables.OperationScenario_Component_HotWaterTank,
+    InputTables.OperationScenario_Component_PV,
+    InputTables.OperationScenario_Component_Region,
+    InputTables.OperationScenario_Component_SpaceCoolingTechnology,
+    InputTables.OperationScenario_Component_SpaceHeatingTank,
+    InputTables.OperationScenario_Component_Vehicle,
+    InputTables.OperationScenario_BehaviorProfile,
+    InputTables.OperationScenario_DrivingProfile_ParkingHome,
+    InputTables.OperationScenario_DrivingProfile_Distance,
+    InputTables.OperationScenario_EnergyPrice,
+    InputTables.OperationScenario_RegionWeather,
+]
+
+
 class OutputTables(Enum):
     # FLEX-Behavior
     BehaviorResult_PersonProfiles = auto()
@@ -63,6 +87,26 @@ class OutputTables(Enum):
     OperationResult_RefYear = auto()
     OperationResult_EnergyCost = auto()
     OperationResult_EnergyCostChange = auto()
+    OperationResult_RunMetrics = auto()
+    OperationResult_SolveStatus = auto()
     # FLEX-Community
     CommunityResult_AggregatorHour = auto()
     CommunityResult_AggregatorYear = auto()
+
+
+# key columns that are indexed in the project database (see utils.db.DB.create_indexes)
+INDEX_COLUMN_PREFIXES = ("ID_", "id_")
+# period result tables that are not listed in OutputTables, e.g. OperationResult_RefDay
+PERIOD_RESULT_TABLE_PREFIXES = ("OperationResult_Ref", "OperationResult_Opt")
+
+
+def is_known_table(table_name: str) -> bool:
+    return table_name in InputTables.__members__ or table_name in OutputTables.__members__ or \
+        table_name.startswith(PERIOD_RESULT_TABLE_PREFIXES)
+
+
+def get_index_columns(table_name: str, column_names: List[str]) -> List[str]:
+    """returns the key columns (ID_Scenario, ID_* and id_*) of a known table, which are indexed"""
+    if not is_known_table(table_name):
+        return []
+    return [column for column in column_names if column.startswith(INDEX_COLUMN_PREFIXES)]
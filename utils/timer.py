@@ -0,0 +1,83 @@
+import time
+from contextlib import contextmanager
+from contextlib import nullcontext
+from typing import List, Tuple, Optional
+
+import pandas as pd
+
+_NULL_STAGE = nullcontext()
+
+
+class StageTimer:
+
+    def __init__(self, enabled: bool = True):
+        """
+        Records the wall-clock duration of the stages of a run (scenario setup, solve, result writing, ...)
+        for each scenario. A disabled timer hands out a shared no-op context, so the instrumented code
+        does not pay for the timing when it is switched off.
+        :param enabled: if False, no durations are recorded
+        """
+        self.enabled = enabled
+        self.records: List[Tuple[int, str, float]] = []
+        self.scenario_num = 0
+        self.start_time = time.perf_counter()
+        self.end_time: Optional[float] = None
+
+    def stage(self, scenario_id: int, stage_name: str):
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._time_stage(scenario_id, stage_name)
+
+    @contextmanager
+    def _time_stage(self, scenario_id: int, stage_name: str):
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append((scenario_id, stage_name, time.perf_counter() - t_start))
+
+    def count_scenario(self):
+        self.scenario_num += 1
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    @property
+    def throughput(self) -> float:
+        """scenarios per second over the whole run"""
+        return self.scenario_num / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records, columns=["ID_Scenario", "Stage", "Seconds"])
+
+    def summarize(self) -> pd.DataFrame:
+        return summarize_stages(self.to_dataframe())
+
+    def summary_text(self) -> str:
+        lines = [f"{self.scenario_num} scenarios in {round(self.elapsed, 2)}s "
+                 f"({round(self.throughput, 3)} scenarios/s)"]
+        if self.records:
+            for _, row in self.summarize().iterrows():
+                lines.append(f"  {row['Stage']:<16} n={row['Count']:<6} total={row['Total']:9.3f}s "
+                             f"p50={row['P50']:8.4f}s p95={row['P95']:8.4f}s")
+        return "\n".join(lines)
+
+
+def summarize_stages(metrics: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param metrics: stage durations with the columns "Stage" and "Seconds", e.g. the OperationResult_RunMetrics table
+    :return: one row per stage with the number of records, the total and mean duration, and the p50/p95 values
+    """
+    stages = metrics.groupby("Stage", sort=False)["Seconds"]
+    return pd.DataFrame({
+        "Count": stages.count(),
+        "Total": stages.sum(),
+        "Mean": stages.mean(),
+        "P50": stages.quantile(0.5),
+        "P95": stages.quantile(0.95),
+    }).reset_index()